@@ -1,7 +1,8 @@
 # Gilbo RPG API -- Version 1.2.10 #
 
 from abc import ABC, abstractmethod
-from enum import IntEnum, auto
+from collections import OrderedDict
+from enum import IntEnum, IntFlag, auto
 
 # 3rd Party Libraries
 import numpy as np
@@ -17,6 +18,7 @@ except ModuleNotFoundError:
 # Inventory-related
 pub_item_obtained = Signal(providing_args=["itms"])
 pub_stat_change = Signal(providing_args=["changes"])
+pub_trade = Signal(providing_args=["buyer", "basket", "price"])
 
 # Entity-position-related
 pub_chk_pos = Signal()
@@ -71,9 +73,14 @@ def write(phrase, type_speed=.029, line_delay=.5):
     print('\n')
 
 
+# Tracks how many times the console has been cleared, so that saved map frames know when they are stale
+console_state = {'clears': 0}
+
+
 def clr_console():
     import os
     os.system('cls' if os.name == 'nt' else 'clear')
+    console_state['clears'] += 1
 
 
 def cli_color(unix, win='color 0F'):
@@ -109,32 +116,39 @@ class Locate_Entity(IntEnum):
 
 
 class entity(ABC):
+    # Entities keep their data in slots rather than a dictionary, so that large crowds of them stay small and quick to read.
+    # Subclasses that declare no __slots__ of their own simply get a __dict__ back. __weakref__ lets the spatial index and events track them.
+    __slots__ = ('entity_name', 'entity_location', '__weakref__')
+
     def __init__(self, name, location, x, y):
-        self.entity_dict = {'name': name}
-        self.entity_dict.update({'location': [location]})
-        self.entity_dict['location'].append([y, x])
+        self.entity_name = name
+        self.entity_location = [location, [y, x]]
+        entity_index.place(self)
 
     @property
     def name(self):
-        return self.entity_dict['name']
+        return self.entity_name
 
     @name.setter
     def name(self, value):
-        self.entity_dict['name'] = value
+        self.entity_name = value
 
     @property
     def location(self):
-        return self.entity_dict['location']
+        return self.entity_location
 
     def set_loc(self, cord, location=None):
         if location is None:
-            location = self.location[Locate_Entity.mapid.value]
+            location = self.entity_location[Locate_Entity.mapid.value]
 
-        self.entity_dict['location'][Locate_Entity.mapid.value] = location
-        self.entity_dict['location'][Locate_Entity.coordinates.value] = cord
+        self.entity_location[Locate_Entity.mapid.value] = location
+        self.entity_location[Locate_Entity.coordinates.value] = cord
+        entity_index.place(self)
 
 
 class NPC(entity):
+    __slots__ = ('dialogue_dict',)
+
     def __init__(self, name, location, x, y):
         super().__init__(name, location, x, y)
         self.dialogue_dict = {}
@@ -147,28 +161,36 @@ class NPC(entity):
 
 
 class vendor(entity):
+    __slots__ = ('entity_inventory',)
+
     def __init__(self, name, location, x, y, inv):
         super().__init__(name, location, x, y)
-        self.entity_dict['inventory'] = inv
+        self.entity_inventory = inv
 
     @property
     def collection(self):
-        return self.entity_dict['inventory']
+        return self.entity_inventory
 
 
 class battler(vendor):
+    __slots__ = ('entity_stats', 'handle_stat_change')
+
     def __init__(self, name, location, x, y, inv, stats):
         super().__init__(name, location, x, y, inv)
-        self.entity_dict['stats'] = stats
+        self.entity_stats = stats
 
         def handle_stat_change(sender, **kwargs):
             self.sub_stat_change(sender, **kwargs)
         self.handle_stat_change = handle_stat_change
         pub_stat_change.connect(handle_stat_change)
 
+        # Apply whatever the battler starts out wearing, including anything equipped before the collection was handed over
+        if isinstance(inv, battler_collection):
+            inv.update_stats(full=True)
+
     @property
     def stats(self):
-        return self.entity_dict['stats']
+        return self.entity_stats
 
     @property
     def attacks(self):
@@ -185,10 +207,12 @@ class battler(vendor):
 
 
 class player(battler):
+    __slots__ = ('quest_list', 'handle_chk_pos')
+
     def __init__(self, name, location, x, y, inv, stats):
         super().__init__(name, location, x, y, inv, stats)
 
-        self.entity_dict['quest_list'] = []
+        self.quest_list = []
 
         def handle_chk_pos(sender, **kwargs):
             self.sub_chk_pos(sender, **kwargs)
@@ -212,6 +236,16 @@ class Stat_Sheet(IntEnum):
     power = 4
 
 
+# Columns of a stat table, e.g. in an entity_store; the first five line up with Stat_Sheet
+class Stat_Columns(IntEnum):
+    health = 0
+    strength = 1
+    armor = 2
+    agility = 3
+    power = 4
+    max_health = 5
+
+
 class Item_Types(IntEnum):
     basic_item = auto()
     basic_equippable = auto()
@@ -298,80 +332,131 @@ class stat_item(equippable):
 
 
 class battler_stats:
+    # Every stat lives in one small array indexed by Stat_Columns, so a whole modifier is applied or reverted in a single step.
+    # The array holds integers until a float is put in it, and then switches to floats. A stat given as None (left unset) is stored as 0.
+    __slots__ = ('stat_array',)
+
     def __init__(self, hp, stren, armr, agil, pwr=1):
-        self.stat_dict = {'hp': hp}
-        self.stat_dict['max_hp'] = hp
-        self.stat_dict['strength'] = stren
-        self.stat_dict['armor'] = armr
-        self.stat_dict['agility'] = agil
-        self.stat_dict['power'] = pwr
+        self.stat_array = np.array([0 if stat is None else stat for stat in (hp, stren, armr, agil, pwr, hp)])
+        if self.stat_array.dtype.kind not in 'if':
+            raise TypeError('Stats must be numbers.')
+
+    @classmethod
+    def view(cls, buffer):
+        # Stats over an existing array of len(Stat_Columns) values, such as one row of an entity_store, that reads and writes it in place
+        stats = cls.__new__(cls)
+        stats.stat_array = buffer
+        return stats
+
+    def fit(self, values):
+        # Switch the array to floats before anything that is not a whole number is added to it
+        values = np.asarray(values)
+        if values.dtype.kind == 'f' and self.stat_array.dtype.kind != 'f':
+            self.stat_array = self.stat_array.astype(float)
+        elif values.dtype.kind not in 'iuf':
+            raise TypeError('An item in stat_change was not a number.')
+
+        return values
+
+    def put(self, column, value):
+        # Plain integers always fit, so they skip the check
+        if type(value) is not int:
+            value = 0 if value is None else self.fit(value)
+
+        self.stat_array[column] = value
 
     @property
     def health(self):
-        return self.stat_dict['hp']
+        return self.stat_array.item(Stat_Columns.health)
 
     @health.setter
     def health(self, value):
-        self.stat_dict['hp'] = value
+        self.put(Stat_Columns.health, value)
 
     @property
     def max_health(self):
-        return self.stat_dict['max_hp']
+        return self.stat_array.item(Stat_Columns.max_health)
 
     @max_health.setter
     def max_health(self, value):
-        self.stat_dict['max_hp'] = value
+        self.put(Stat_Columns.max_health, value)
 
     @property
     def stren(self):
-        return self.stat_dict['strength']
+        return self.stat_array.item(Stat_Columns.strength)
 
     @stren.setter
     def stren(self, value):
-        self.stat_dict['strength'] = value
+        self.put(Stat_Columns.strength, value)
 
     @property
     def armor(self):
-        return self.stat_dict['armor']
+        return self.stat_array.item(Stat_Columns.armor)
 
     @armor.setter
     def armor(self, value):
-        self.stat_dict['armor'] = value
+        self.put(Stat_Columns.armor, value)
 
     @property
     def agility(self):
-        return self.stat_dict['agility']
+        return self.stat_array.item(Stat_Columns.agility)
 
     @agility.setter
     def agility(self, value):
-        self.stat_dict['agility'] = value
+        self.put(Stat_Columns.agility, value)
 
     @property
     def power(self):
-        return self.stat_dict['power']
+        return self.stat_array.item(Stat_Columns.power)
 
     @power.setter
     def power(self, value):
-        self.stat_dict['power'] = value
+        self.put(Stat_Columns.power, value)
 
     @property
     def stat_list(self):
-        return [self.health, self.max_health, self.stren, self.armor, self.agility, self.power]
-
-    def set_stats(self, val, permanent=True):
+        return self.stat_array[[Stat_Columns.health, Stat_Columns.max_health, Stat_Columns.strength, Stat_Columns.armor, Stat_Columns.agility, Stat_Columns.power]].tolist()
+
+    @staticmethod
+    def modifier(val, permanent=True):
+        # Turn a Stat_Sheet list of changes into a change to every column; only permanent changes move max_health along with health
+        val = np.asarray(val)
+        if val.shape != (len(Stat_Sheet),):
+            raise ValueError(f'A stat change must be a list of {len(Stat_Sheet)} numbers, one for each Stat_Sheet member.')
+
+        return np.append(val, val[Stat_Sheet.health] if permanent is True else 0)
+
+    @staticmethod
+    def sum_modifiers(vals):
+        # Add up any number of Stat_Sheet lists into one
+        vals = np.asarray(vals).reshape(-1, len(Stat_Sheet))
+        return vals.sum(axis=0)
+
+    def change_stats(self, vals, permanent=True, sign=1, many=False):
+        # Add (sign=1) or take away (sign=-1) one Stat_Sheet list, or the sum of many. A malformed change is logged and skipped,
+        # so a bad stat_change on an item never stops the game.
         try:
-            self.health += val[Stat_Sheet.health]
-            if permanent is True:
-                self.max_health += val[Stat_Sheet.health]
-            self.stren += val[Stat_Sheet.strength]
-            self.armor += val[Stat_Sheet.armor]
-            self.agility += val[Stat_Sheet.agility]
-            self.power += val[Stat_Sheet.power]
-        except IndexError as e:
+            val = self.sum_modifiers(vals) if many is True else vals
+            self.stat_array += self.fit(self.modifier(val, permanent)) * sign
+        except (IndexError, ValueError) as e:
             debug_info(e, 'battler_stats.stat_list only accepts lists as setters.', True)
         except TypeError as e:
             debug_info(e, 'An item in stat_change was not a number.', True)
 
+    def set_stats(self, val, permanent=True):
+        self.change_stats(val, permanent)
+
+    def revert_stats(self, val, permanent=True):
+        # Undo a change made by set_stats()
+        self.change_stats(val, permanent, -1)
+
+    def apply_modifiers(self, vals, permanent=True):
+        # Apply many Stat_Sheet lists at once, e.g. every equipped item
+        self.change_stats(vals, permanent, 1, True)
+
+    def revert_modifiers(self, vals, permanent=True):
+        self.change_stats(vals, permanent, -1, True)
+
     def writeout(self):
         print(f"Health: {self.health}/{self.max_health}")
         print(f"Strength: {self.stren}")
@@ -396,6 +481,11 @@ class Directions(IntEnum):
     Down_Right = 33
 
 
+# Row and column change for each direction: the tens digit of a Directions value is its row, and the ones digit its column
+direction_offsets = {direction: (direction // 10 - 2, direction % 10 - 2) for direction in Directions}
+offset_directions = {offset: direction for direction, offset in direction_offsets.items()}
+
+
 class Location_Errors(IntEnum):
     no_exist = 0
     invalid_direction = 1
@@ -415,6 +505,14 @@ class Tiles(IntEnum):
     Pit = auto()
 
 
+class Tile_Flags(IntFlag):
+    # Each flag is one bit of an array_map's packed flag layer
+    walkable = 1
+    hazard = 2
+    opaque = 4
+    scripted = 8
+
+
 class location_manager:
     def __init__(self):
         self.xy_dict = {'Errors': []}
@@ -423,6 +521,18 @@ class location_manager:
         self.xy_dict['Errors'].append("You cannot go that way.")
         self.xy_dict['auto_load'] = True
         self.xy_dict['current_map'] = None
+        # Tile -> glyph lookup table, built the first time a map is drawn
+        self.xy_dict['glyphs'] = None
+        # Only redraw the cells that changed since the last frame
+        self.xy_dict['incremental'] = False
+        self.xy_dict['last_frame'] = None
+        # Size of the window that follows the player; None draws maps from their top-left corner
+        self.xy_dict['camera'] = None
+        self.xy_dict['camera_origin'] = [0, 0]
+        # A field_of_view for the player when fog of war is on, otherwise None
+        self.xy_dict['sight'] = None
+        # The world_graph whose portals entities travel through, if there is one
+        self.xy_dict['world'] = None
 
     @property
     def auto_load_map(self):
@@ -436,6 +546,66 @@ class location_manager:
         else:
             raise TypeError('Value must be True or False.')
 
+    @property
+    def incremental_redraw(self):
+        return self.xy_dict['incremental']
+
+    @incremental_redraw.setter
+    def incremental_redraw(self, value):
+        if value is True or value is False:
+            self.xy_dict['incremental'] = value
+            self.xy_dict['last_frame'] = None
+        else:
+            raise TypeError('Value must be True or False.')
+
+    @property
+    def camera(self):
+        return self.xy_dict['camera']
+
+    @camera.setter
+    def camera(self, value):
+        if value is None or (len(value) == 2 and all(isinstance(i, int) and i > 0 for i in value)):
+            self.xy_dict['camera'] = None if value is None else tuple(value)
+            self.xy_dict['last_frame'] = None
+        else:
+            raise TypeError('Value must be None, or a (rows, columns) pair of positive integers.')
+
+    @property
+    def camera_origin(self):
+        return self.xy_dict['camera_origin']
+
+    @property
+    def fog_of_war(self):
+        return self.xy_dict['sight'] is not None
+
+    @fog_of_war.setter
+    def fog_of_war(self, value):
+        # Hides every tile the player has not yet seen
+        if value is True:
+            if self.xy_dict['sight'] is None:
+                self.xy_dict['sight'] = field_of_view()
+        elif value is False:
+            self.xy_dict['sight'] = None
+        else:
+            raise TypeError('Value must be True or False.')
+
+        self.xy_dict['last_frame'] = None
+
+    @property
+    def sight(self):
+        return self.xy_dict['sight']
+
+    @property
+    def world(self):
+        return self.xy_dict['world']
+
+    @world.setter
+    def world(self, value):
+        if value is None or isinstance(value, world_graph):
+            self.xy_dict['world'] = value
+        else:
+            raise TypeError('Value must be None or a world_graph.')
+
     @property
     def player_pos(self):
         return self.xy_dict['player_location']
@@ -445,6 +615,9 @@ class location_manager:
         self.xy_dict['player_location'] = val
 
     def load_if_player(self, thing):
+        if isinstance(thing, player):
+            self.prefetch(thing)
+
         if self.auto_load_map is True:
             pub_chk_pos.send(sender=self)
             if isinstance(thing, player):
@@ -452,123 +625,680 @@ class location_manager:
         else:
             clr_console()
 
+    def prefetch(self, thing):
+        # Page in the chunks around an entity on a chunked map before it walks into them
+        layout = getattr(thing.location[Locate_Entity.mapid], 'layout', None)
+        if isinstance(layout, chunked_layout):
+            layout.prefetch(thing.location[Locate_Entity.coordinates])
+
+        # Start loading the maps behind any portals nearby, so walking through one does not stall
+        if self.world is not None:
+            self.world.preload_near(thing.location[Locate_Entity.mapid], thing.location[Locate_Entity.coordinates])
+
     def move(self, thing, direction):
         # Insert data collection from map
-        if self.chk_boundary(thing.location[Locate_Entity.mapid], direction.value, thing.location[Locate_Entity.coordinates], False) is not False:
-            thing.set_loc(self.chk_boundary(thing.location[Locate_Entity.mapid], direction.value, thing.location[Locate_Entity.coordinates], True if isinstance(thing, player) else False, True))
-            # Check to see if the map needs to be reloaded
+        start_loc = list(thing.location[Locate_Entity.coordinates])
+        new_loc = self.chk_boundary(thing.location[Locate_Entity.mapid], direction.value, thing.location[Locate_Entity.coordinates], True if isinstance(thing, player) else False, True)
+        if new_loc is not False:
+            thing.set_loc(new_loc)
+            # Go through a portal if the entity stepped onto one, otherwise check to see if the map needs to be reloaded
+            if list(new_loc) == start_loc or self.use_portal(thing) is False:
+                self.load_if_player(thing)
+
+    def use_portal(self, thing, redraw=True):
+        # Send an entity to the other end of the world's portal it is standing on. Returns True if it went through.
+        if self.world is None:
+            return False
+
+        arrival = self.world.portal_at(thing.location[Locate_Entity.mapid], thing.location[Locate_Entity.coordinates])
+        if arrival is None:
+            return False
+
+        mapid, (y, x) = arrival
+        if mapid.enter((y, x), True if isinstance(thing, player) else False) is not True:
+            return False
+
+        thing.set_loc([y, x], mapid)
+        if redraw is True:
             self.load_if_player(thing)
 
+        return True
+
+    def step_all(self, things, directions):
+        # Move a batch of entities one step each in the same tick, redrawing at most once at the end.
+        # directions is one Directions value for everyone, or one per entity (None to stay still). Returns which entities moved.
+        if isinstance(directions, Directions) or directions is None:
+            directions = [directions] * len(things)
+
+        moved = np.zeros(len(things), dtype=bool)
+
+        # Entities on different maps never collide, so each map is handled on its own
+        groups = {}
+        for i, thing in enumerate(things):
+            groups.setdefault(id(thing.location[Locate_Entity.mapid]), []).append(i)
+
+        for indices in groups.values():
+            mapid = things[indices[0]].location[Locate_Entity.mapid]
+            group = [things[i] for i in indices]
+            moved[indices] = self.step_group(mapid, group, [directions[i] for i in indices])
+
+        # Portals are taken after everyone has moved, so an entity arriving on another map cannot collide with anything this tick
+        for i in np.flatnonzero(moved):
+            self.use_portal(things[i], False)
+
+        # One redraw for the whole tick, preferring a player that moved
+        movers = [things[i] for i in np.flatnonzero(moved)]
+        if movers != []:
+            self.load_if_player(next((thing for thing in movers if isinstance(thing, player)), movers[0]))
+
+        return moved.tolist()
+
+    def step_group(self, mapid, things, directions):
+        count = len(things)
+        start = np.array([thing.location[Locate_Entity.coordinates] for thing in things], dtype=np.intp).reshape(count, 2)
+        delta = np.array([direction_offsets.get(direction, (0, 0)) for direction in directions], dtype=np.intp).reshape(count, 2)
+        target = start + delta
+        height, width = mapid.layout.shape
+
+        # Bounds and passability for every mover at once
+        moving = (delta != 0).any(axis=1)
+        moving &= (target[:, 0] >= 0) & (target[:, 0] < height) & (target[:, 1] >= 0) & (target[:, 1] < width)
+
+        if isinstance(mapid.layout, chunked_layout):
+            passable = np.zeros(count, dtype=bool)
+            scripted = np.zeros(count, dtype=bool)
+            for i in np.flatnonzero(moving):
+                passable[i], scripted[i] = self.tile_rules(mapid, target[i])
+                if passable[i] and delta[i].all():
+                    passable[i] = self.tile_rules(mapid, (target[i, 0], start[i, 1]))[0] and self.tile_rules(mapid, (start[i, 0], target[i, 1]))[0]
+        else:
+            safe_target = np.where(moving[:, None], target, start)
+            passable = mapid.passable[safe_target[:, 0], safe_target[:, 1]]
+            scripted = mapid.scripted[safe_target[:, 0], safe_target[:, 1]]
+
+            # Diagonal steps may not cut across a blocked corner
+            diagonal = moving & delta.all(axis=1)
+            passable = passable & ~(diagonal & ~(mapid.passable[safe_target[:, 0], start[:, 1]] & mapid.passable[start[:, 0], safe_target[:, 1]]))
+
+        moving &= passable
+        asked = np.zeros(count, dtype=bool)
+
+        # Tiles with triggers on them have to be asked about too, even if they are not scripted
+        found = {}
+        if mapid.has_triggers:
+            for i in np.flatnonzero(moving):
+                at = mapid.triggers_at(target[i])
+                if at != []:
+                    found[i] = at
+
+        triggered = np.zeros(count, dtype=bool)
+        triggered[list(found)] = True
+        fired = {}
+        fired_mask = np.zeros(count, dtype=bool)
+
+        while True:
+            self.resolve_collisions(start, target, moving, width)
+
+            # Scripted tiles are only asked about once the mover is sure to get there, and never twice
+            to_ask = np.flatnonzero(moving & scripted & ~asked)
+            for i in to_ask:
+                asked[i] = True
+                if mapid.send_data(tuple(target[i].tolist()), True if isinstance(things[i], player) else False) is not True:
+                    moving[i] = False
+
+            if to_ask.size != 0:
+                continue
+
+            # Triggers go last, once nothing but another trigger can stop the mover, and a mover's triggers only fire once everyone
+            # moving out of the tile it is entering has been let through; after a refusal collisions are settled again first.
+            pending = moving & triggered & ~fired_mask
+            if not pending.any():
+                break
+
+            to_fire = np.flatnonzero(pending & self.clear_ahead(start, target, moving, pending, width))
+            if to_fire.size == 0:
+                # Only a ring of movers stepping into each other's tiles has no one to go first. Its first mover fires anyway, and if a
+                # later trigger in the ring refuses, the whole ring stays put and the actions already run are void (nothing is spent).
+                to_fire = np.flatnonzero(pending)[:1]
+
+            for i in to_fire:
+                fired_mask[i] = True
+                fired[i] = mapid.fire_triggers(tuple(target[i].tolist()), True if isinstance(things[i], player) else False, found[i])
+                if fired[i] is False:
+                    moving[i] = False
+                    break
+
+        for i in np.flatnonzero(moving):
+            things[i].set_loc(target[i].tolist())
+            for trigger in fired.get(i, ()):
+                trigger.spend()
+
+        return moving
+
+    def clear_ahead(self, start, target, moving, pending, width):
+        # True for movers whose way is settled: every mover leaving the tile they are entering has no triggers left to fire and is clear too
+        start_keys = (start[:, 0] * width + start[:, 1]).tolist()
+        target_keys = (target[:, 0] * width + target[:, 1]).tolist()
+        leaving = {}
+        for j in np.flatnonzero(moving):
+            leaving.setdefault(start_keys[j], []).append(j)
+
+        clear = np.zeros(len(start), dtype=bool)
+        changed = True
+        while changed:
+            changed = False
+            for i in np.flatnonzero(moving & ~clear):
+                if all(clear[j] and not pending[j] for j in leaving.get(target_keys[i], ())):
+                    clear[i] = True
+                    changed = True
+
+        return clear
+
+    def resolve_collisions(self, start, target, moving, width):
+        # Stop movers until no two entities share a tile; entities standing still always keep their tile, then the earliest mover wins
+        count = len(start)
+        index = np.arange(count)
+        start_keys = start[:, 0] * width + start[:, 1]
+
+        while True:
+            final = np.where(moving[:, None], target, start)
+            keys = final[:, 0] * width + final[:, 1]
+
+            order = np.lexsort((index, moving, keys))
+            crowded = np.zeros(count, dtype=bool)
+            crowded[order[1:]] = keys[order[1:]] == keys[order[:-1]]
+            blocked = crowded & moving
+
+            # Two movers may not swap tiles by passing through each other. Several entities may start on one tile, so a mover looks for
+            # any other mover going the opposite way between the same two tiles, matching (start, final) pairs rather than start tiles.
+            if moving.any():
+                span = int(max(start_keys.max(), keys.max())) + 1
+                pairs = np.sort(start_keys[moving] * span + keys[moving])
+                opposite = keys * span + start_keys
+                found = pairs[np.minimum(np.searchsorted(pairs, opposite), len(pairs) - 1)]
+                blocked |= moving & (found == opposite)
+
+            if not blocked.any():
+                return moving
+
+            moving &= ~blocked
+
     def teleport(self, thing, mapid, x, y):
         # Wrap around try just in case the map is mispelled or does not yet exist
         try:
             # Insert data collection from map, and writeout extra details if the entity is a player
-            if mapid.send_data((y, x), True if isinstance(thing, player) else False) is True:
+            if mapid.enter((y, x), True if isinstance(thing, player) else False) is True:
                 thing.set_loc([y, x], mapid)
                 self.load_if_player(thing)
 
         except NameError as e:
             debug_info(e, 'That map does not exist', True)
 
+    def tile_rules(self, mapid, cord):
+        # Whether a tile is passable and whether it is scripted; chunked layouts are looked up one tile at a time instead of through the masks
+        if isinstance(mapid.layout, chunked_layout):
+            flags = mapid.flags_at(cord)
+            return Tile_Flags.walkable in flags, Tile_Flags.scripted in flags
+
+        y, x = cord
+        return bool(mapid.passable[y, x]), bool(mapid.scripted[y, x])
+
     def chk_boundary(self, mapid, direction, start_loc, is_player, print_errors=False):
         # Update coordinates for direction
-        if direction is Directions.Up.value:
-            new_loc = [start_loc[Locate_Entity.y_cord] - 1, start_loc[Locate_Entity.x_cord]]
-        elif direction is Directions.Down.value:
-            new_loc = [start_loc[Locate_Entity.y_cord] + 1, start_loc[Locate_Entity.x_cord]]
-        elif direction is Directions.Left.value:
-            new_loc = [start_loc[Locate_Entity.y_cord], start_loc[Locate_Entity.x_cord] - 1]
-        elif direction is Directions.Right.value:
-            new_loc = [start_loc[Locate_Entity.y_cord], start_loc[Locate_Entity.x_cord] + 1]
-
         try:
-            # Test if new coordinate is out of bounds
-            mapid.layout[new_loc[Locate_Entity.y_cord], new_loc[Locate_Entity.x_cord]]
-
-            # Check if new coordinate is negative
-            for i in new_loc:
-                if i < 0:
-                    if print_errors is True:
-                        print(self.xy_dict['Errors'][Location_Errors.invalid_direction])
+            dy, dx = direction_offsets[direction]
+        except KeyError:
+            if print_errors is True:
+                print(self.xy_dict['Errors'][Location_Errors.invalid_direction])
 
-                    return start_loc
+            return False
 
-            # Check against the mapid's send_data method to see what it wants the location manager to do
-            if mapid.send_data(tuple(new_loc), True if is_player is True else False) is True:
-                return new_loc
-            else:
-                return False
+        new_loc = [start_loc[Locate_Entity.y_cord] + dy, start_loc[Locate_Entity.x_cord] + dx]
+        y, x = new_loc
+        height, width = mapid.layout.shape
 
-        except IndexError:
+        # Test if new coordinate is out of bounds
+        if not ((0 <= y < height) and (0 <= x < width)):
             if print_errors is True:
                 # Tell the user that it cannot move that way
                 print(self.xy_dict['Errors'][Location_Errors.invalid_direction])
 
             return start_loc
 
-    def detect_tile(self, til, player_til=False):
+        passable, scripted = self.tile_rules(mapid, new_loc)
+
+        # Diagonal steps may not cut across a blocked corner, the same as in path_finder
+        if passable and dy != 0 and dx != 0:
+            passable = self.tile_rules(mapid, (y, x - dx))[0] and self.tile_rules(mapid, (y - dy, x))[0]
+
+        if not passable:
+            if print_errors is True:
+                print(self.xy_dict['Errors'][Location_Errors.invalid_direction])
+
+            return False
+
+        # Only scripted tiles, and tiles with triggers, are checked with the mapid to see what it wants the location manager to do
+        found = mapid.triggers_at(new_loc) if mapid.has_triggers else []
+        if scripted or found != []:
+            if mapid.enter(tuple(new_loc), True if is_player is True else False, scripted, found) is True:
+                return new_loc
+            else:
+                return False
+
+        return new_loc
+
+    @property
+    def tile_glyphs(self):
+        # Lookup table indexed by tile value; entries offset by len(Tiles) + 1 are the same tiles with the player standing on them
+        if self.xy_dict['glyphs'] is None:
             from colorama import Fore, Back, Style
-            value = ''
+
+            # Set unicode value of character based on Enum value
+            tile_art = {
+                Tiles.Grass: Fore.GREEN + Style.BRIGHT + '\u26B6',
+                Tiles.Wall: Fore.WHITE + Style.DIM + '\u26DD',
+                Tiles.Mountain: Fore.YELLOW + '\u1A12',
+                Tiles.Cave: Fore.YELLOW + '\u1A0A',
+                Tiles.Water: Fore.CYAN + '\u2307',
+                Tiles.Building: Fore.WHITE + '\u16A5',
+                Tiles.Lava: Fore.RED + Style.BRIGHT + '\u26C6',
+                Tiles.Dirt: Fore.YELLOW + Style.BRIGHT + '\u26C6',
+                Tiles.Ice: Fore.CYAN + Style.BRIGHT + '\u26C6',
+                Tiles.Pit: Fore.BLACK + Style.DIM + '\u25CF',
+            }
+
+            # Unknown tiles are blank, so every cell is the same width for cursor addressing
+            glyphs = [' '] * (max(Tiles) + 1)
+            for til, art in tile_art.items():
+                glyphs[til] = art + Style.RESET_ALL
 
             # Set the background color to magenta to signify that the player is there
-            if player_til is True:
-                value += Back.MAGENTA
+            self.xy_dict['glyphs'] = np.array(glyphs + [Back.MAGENTA + glyph for glyph in glyphs], dtype=object)
 
-            # Set unicode value of character based on Enum value
-            if til == Tiles.Grass.value:
-                value += Fore.GREEN + Style.BRIGHT + '\u26B6' + Style.RESET_ALL
-            elif til == Tiles.Wall.value:
-                value += Fore.WHITE + Style.DIM + '\u26DD' + Style.RESET_ALL
-            elif til == Tiles.Mountain.value:
-                value += Fore.YELLOW + '\u1A12' + Style.RESET_ALL
-            elif til == Tiles.Cave.value:
-                value += Fore.YELLOW + '\u1A0A' + Style.RESET_ALL
-            elif til == Tiles.Water.value:
-                value += Fore.CYAN + '\u2307' + Style.RESET_ALL
-            elif til == Tiles.Building.value:
-                value += Fore.WHITE + '\u16A5' + Style.RESET_ALL
-            elif til == Tiles.Lava.value:
-                value += Fore.RED + Style.BRIGHT + '\u26C6' + Style.RESET_ALL
-            elif til == Tiles.Dirt.value:
-                value += Fore.YELLOW + Style.BRIGHT + '\u26C6' + Style.RESET_ALL
-            elif til == Tiles.Ice.value:
-                value += Fore.CYAN + Style.BRIGHT + '\u26C6' + Style.RESET_ALL
-            elif til == Tiles.Pit.value:
-                value += Fore.BLACK + Style.DIM + '\u25CF' + Style.RESET_ALL
-
-            return value
+        return self.xy_dict['glyphs']
+
+    def detect_tile(self, til, player_til=False):
+        if not 0 <= til <= max(Tiles):
+            til = 0
+
+        return self.tile_glyphs[int(til) + (max(Tiles) + 1 if player_til is True else 0)]
+
+    def view_window(self, mapid, rows=None, clmns=None):
+        # Find the top-left corner and size of the block of the map to draw
+        height, width = mapid.layout.shape
+
+        if self.camera is None:
+            return 0, 0, height if rows is None else min(rows, height), width if clmns is None else min(clmns, width)
+
+        rows = min(self.camera[Locate_Entity.y_cord] if rows is None else rows, height)
+        clmns = min(self.camera[Locate_Entity.x_cord] if clmns is None else clmns, width)
+
+        # Centre the camera on the player, stopping it at the edges of the map
+        top, left = self.camera_origin
+        if mapid is self.player_pos[Locate_Entity.mapid]:
+            y, x = self.player_pos[Locate_Entity.coordinates]
+            top = y - rows // 2
+            left = x - clmns // 2
+
+        top = max(0, min(top, height - rows))
+        left = max(0, min(left, width - clmns))
+        self.xy_dict['camera_origin'] = [top, left]
+
+        return top, left, rows, clmns
+
+    def glyph_codes(self, mapid, rows=None, clmns=None):
+        # Convert the visible block of the layout into indexes for tile_glyphs, with unknown tile values mapped to a blank glyph
+        top, left, rows, clmns = self.view_window(mapid, rows, clmns)
+        codes = np.asarray(mapid.layout[top:top + rows, left:left + clmns]).astype(np.intp)
+        codes[(codes < 0) | (codes > max(Tiles))] = 0
+
+        # Blank out everything the player has not explored
+        if self.fog_of_war and mapid is self.player_pos[Locate_Entity.mapid]:
+            self.sight.reveal(mapid, self.player_pos[Locate_Entity.coordinates])
+            codes[~self.sight.explored(mapid, top, left, top + codes.shape[0], left + codes.shape[1])] = 0
+
+        # Test for player position against tile
+        if mapid is self.player_pos[Locate_Entity.mapid]:
+            y, x = self.player_pos[Locate_Entity.coordinates]
+            y -= top
+            x -= left
+            if (0 <= y < rows) and (0 <= x < clmns):
+                codes[y, x] += max(Tiles) + 1
+
+        return codes
+
+    def frame_text(self, codes):
+        # Look every tile up at once, then join each row into a line
+        glyphs = self.tile_glyphs[codes]
+        return ''.join(' '.join(row) + ' \n' for row in glyphs.tolist())
+
+    def frame_changes(self, codes, last_codes):
+        # Move the cursor to each changed cell (two columns per tile) and draw only that glyph
+        glyphs = self.tile_glyphs
+        changes = ''.join(f'\x1b[{y + 1};{2 * x + 1}H' + glyphs[codes[y, x]] for y, x in np.argwhere(codes != last_codes).tolist())
+
+        # Park the cursor under the map and clear any text left below it
+        return changes + f'\x1b[{codes.shape[Locate_Entity.y_cord] + 1};1H\x1b[J'
+
+    def render_frame(self, mapid, rows=None, clmns=None):
+        return self.frame_text(self.glyph_codes(mapid, rows, clmns))
 
     def load_map(self, mapid, rows=None, clmns=None):
-        clr_console()
+        from sys import stdout
 
         # Get player position through event
         pub_chk_pos.send(sender=self)
 
-        # Auto generate columns and rows if they are not provided
-        if clmns is None:
-            clmns = mapid.layout.shape[Locate_Entity.x_cord]
-        if rows is None:
-            rows = mapid.layout.shape[Locate_Entity.y_cord]
-
-        # Loop through rows and columns to send each one to the detect_tile method
-        for y in range(rows):
-            for x in range(clmns):
-                # Test for player position against tile
-                if ([y, x] == self.player_pos[Locate_Entity.coordinates]) and (mapid is self.player_pos[Locate_Entity.mapid]):
-                    print(self.detect_tile(mapid.layout[y, x], True), end=' ')
-                else:
-                    print(self.detect_tile(mapid.layout[y, x]), end=' ')
+        codes = self.glyph_codes(mapid, rows, clmns)
+        last_frame = self.xy_dict['last_frame']
 
-            print()
+        # Redraw only the changed cells if the same map, at the same size, is still on an uncleared screen
+        if (self.incremental_redraw is True) and (last_frame is not None) and (last_frame[0] is mapid) and (last_frame[1].shape == codes.shape) and (last_frame[2] == console_state['clears']):
+            stdout.write(self.frame_changes(codes, last_frame[1]))
+        else:
+            # Clear the screen and draw the whole frame in a single write
+            stdout.write('\x1b[2J\x1b[H' + self.frame_text(codes))
+        stdout.flush()
+
+        self.xy_dict['last_frame'] = (mapid, codes, console_state['clears'])
 
         # Update the current mapid
         self.xy_dict['current_map'] = mapid
 
 
+class chunked_layout:
+    # A map layout stored on disk as fixed-size chunks of .npy files, which are memory-mapped only while they are in use.
+    # It can be indexed and sliced like a 2D np.ndarray, so it can be used anywhere an array_map's layout is.
+    # Changes stay with this session unless write_through is True, so several games can share one world on disk. A changed chunk
+    # that has to be unloaded is spilled to a private temporary file instead of the shared one, so memory stays within max_chunks;
+    # discard() throws the session's changes away and the spill files go when the layout does.
+    def __init__(self, folder, max_chunks=64, write_through=False):
+        import json
+        import os
+
+        with open(os.path.join(folder, 'layout.json')) as handle:
+            meta = json.load(handle)
+
+        self.chunk_dict = {'folder': folder, 'shape': tuple(meta['shape']), 'chunk_size': meta['chunk_size'], 'dtype': np.dtype(meta['dtype'])}
+        from threading import RLock
+
+        self.chunk_dict['max_chunks'] = max_chunks
+        self.chunk_dict['write_through'] = write_through
+        # Loaded chunks, from least to most recently used
+        self.chunk_dict['loaded'] = OrderedDict()
+        # Chunks changed in memory only, which have to be spilled before they are unloaded
+        self.chunk_dict['dirty'] = set()
+        # Folder holding this session's spilled chunks, made the first time one is needed, and the chunks that are in it
+        self.chunk_dict['spill'] = None
+        self.chunk_dict['spilled'] = set()
+        # Chunks may be prefetched from a world_graph's loader thread
+        self.chunk_dict['lock'] = RLock()
+
+    @classmethod
+    def create(cls, folder, shape, chunk_size=256, dtype=np.uint8, fill=0, max_chunks=64, write_through=False):
+        # Write an empty world to disk one chunk at a time, so it never has to fit in memory
+        import json
+        import os
+
+        os.makedirs(folder, exist_ok=True)
+        for cy in range(-(-shape[Locate_Entity.y_cord] // chunk_size)):
+            for cx in range(-(-shape[Locate_Entity.x_cord] // chunk_size)):
+                height = min(chunk_size, shape[Locate_Entity.y_cord] - cy * chunk_size)
+                width = min(chunk_size, shape[Locate_Entity.x_cord] - cx * chunk_size)
+                np.save(os.path.join(folder, f'chunk_{cy}_{cx}.npy'), np.full((height, width), fill, dtype=dtype))
+
+        with open(os.path.join(folder, 'layout.json'), 'w') as handle:
+            json.dump({'shape': list(shape), 'chunk_size': chunk_size, 'dtype': np.dtype(dtype).str}, handle)
+
+        return cls(folder, max_chunks, write_through)
+
+    @classmethod
+    def save(cls, layout, folder, chunk_size=256, max_chunks=64, write_through=False):
+        # Split an in-memory layout into chunks on disk
+        new_layout = cls.create(folder, layout.shape, chunk_size, layout.dtype, 0, max_chunks, True)
+        new_layout[:, :] = layout
+        new_layout.flush()
+
+        return new_layout if write_through is True else cls(folder, max_chunks)
+
+    @property
+    def shape(self):
+        return self.chunk_dict['shape']
+
+    @property
+    def ndim(self):
+        return 2
+
+    @property
+    def dtype(self):
+        return self.chunk_dict['dtype']
+
+    @property
+    def chunk_size(self):
+        return self.chunk_dict['chunk_size']
+
+    @property
+    def loaded(self):
+        return list(self.chunk_dict['loaded'])
+
+    @property
+    def write_through(self):
+        return self.chunk_dict['write_through']
+
+    def chunk(self, cy, cx):
+        with self.chunk_dict['lock']:
+            loaded = self.chunk_dict['loaded']
+            try:
+                loaded.move_to_end((cy, cx))
+                return loaded[(cy, cx)]
+            except KeyError:
+                import os
+                if (cy, cx) in self.chunk_dict['spilled']:
+                    # The session's own copy, which is written straight back to its spill file
+                    block = np.load(self.spill_path(cy, cx), mmap_mode='r+')
+                else:
+                    # Copy-on-write unless asked to write through, so a session never changes the files under another
+                    block = np.load(os.path.join(self.chunk_dict['folder'], f'chunk_{cy}_{cx}.npy'), mmap_mode='r+' if self.write_through is True else 'c')
+                loaded[(cy, cx)] = block
+
+                # Evict the least recently used chunks, spilling any that were changed in memory
+                while len(loaded) > self.chunk_dict['max_chunks']:
+                    oldest, evicted = loaded.popitem(last=False)
+                    if oldest in self.chunk_dict['dirty']:
+                        np.save(self.spill_path(*oldest), evicted)
+                        self.chunk_dict['spilled'].add(oldest)
+                        self.chunk_dict['dirty'].discard(oldest)
+                    elif self.write_through is True or oldest in self.chunk_dict['spilled']:
+                        evicted.flush()
+
+                return block
+
+    def spill_path(self, cy, cx):
+        import os
+
+        if self.chunk_dict['spill'] is None:
+            import shutil
+            import tempfile
+            import weakref
+
+            self.chunk_dict['spill'] = tempfile.mkdtemp(prefix='gilbo_chunks_')
+            weakref.finalize(self, shutil.rmtree, self.chunk_dict['spill'], True)
+
+        return os.path.join(self.chunk_dict['spill'], f'chunk_{cy}_{cx}.npy')
+
+    def flush(self):
+        # Write changes to disk: to the world's own files if the layout writes through, otherwise only to this session's spill files
+        with self.chunk_dict['lock']:
+            for key, block in self.chunk_dict['loaded'].items():
+                if self.write_through is True or key in self.chunk_dict['spilled']:
+                    block.flush()
+
+    def discard(self):
+        # Throw away every change this session has made, going back to the world on disk; does nothing if the layout writes through
+        if self.write_through is True:
+            return
+
+        with self.chunk_dict['lock']:
+            import os
+
+            for key in self.chunk_dict['dirty'] | self.chunk_dict['spilled']:
+                self.chunk_dict['loaded'].pop(key, None)
+            for key in self.chunk_dict['spilled']:
+                os.remove(self.spill_path(*key))
+            self.chunk_dict['dirty'] = set()
+            self.chunk_dict['spilled'] = set()
+
+    def prefetch(self, cord, radius=1):
+        # Load every chunk within 'radius' chunks of a coordinate
+        cy = cord[Locate_Entity.y_cord] // self.chunk_size
+        cx = cord[Locate_Entity.x_cord] // self.chunk_size
+        for y in range(max(cy - radius, 0), min(cy + radius + 1, -(-self.shape[Locate_Entity.y_cord] // self.chunk_size))):
+            for x in range(max(cx - radius, 0), min(cx + radius + 1, -(-self.shape[Locate_Entity.x_cord] // self.chunk_size))):
+                self.chunk(y, x)
+
+    def parse_key(self, key):
+        # Turn an index into a pair of (start, stop) ranges, noting which axes were single integers
+        if not isinstance(key, tuple):
+            key = (key, slice(None))
+        if len(key) != 2:
+            raise IndexError('chunked_layout only supports 2D indexing.')
+
+        ranges = []
+        for axis, index in enumerate(key):
+            size = self.shape[axis]
+            if isinstance(index, slice):
+                start, stop, step = index.indices(size)
+                if step != 1:
+                    raise IndexError('chunked_layout does not support slice steps.')
+                ranges.append((start, max(start, stop), False))
+            else:
+                index = int(index)
+                if not -size <= index < size:
+                    raise IndexError(f'index {index} is out of bounds for axis {axis} with size {size}')
+                index %= size
+                ranges.append((index, index + 1, True))
+
+        return ranges
+
+    def blocks(self, ranges):
+        # Yield each chunk that overlaps the ranges, with the overlap in chunk and in output coordinates
+        (y0, y1, _), (x0, x1, _) = ranges
+        size = self.chunk_size
+        for cy in range(y0 // size, -(-y1 // size)):
+            for cx in range(x0 // size, -(-x1 // size)):
+                top, bottom = max(y0, cy * size), min(y1, (cy + 1) * size)
+                left, right = max(x0, cx * size), min(x1, (cx + 1) * size)
+                yield self.chunk(cy, cx), (slice(top - cy * size, bottom - cy * size), slice(left - cx * size, right - cx * size)), (slice(top - y0, bottom - y0), slice(left - x0, right - x0))
+
+    def __getitem__(self, key):
+        ranges = self.parse_key(key)
+        out = np.empty((ranges[0][1] - ranges[0][0], ranges[1][1] - ranges[1][0]), dtype=self.dtype)
+        for block, inside, outside in self.blocks(ranges):
+            out[outside] = block[inside]
+
+        # Drop the axes that were indexed with integers, like NumPy does
+        return out[tuple(0 if is_int else slice(None) for _, _, is_int in ranges)]
+
+    def __setitem__(self, key, value):
+        ranges = self.parse_key(key)
+        value = np.broadcast_to(np.asarray(value), (ranges[0][1] - ranges[0][0], ranges[1][1] - ranges[1][0]))
+        size = self.chunk_size
+        # Held so that a chunk cannot be unloaded by the loader thread between being changed and being marked as changed
+        with self.chunk_dict['lock']:
+            for block, inside, outside in self.blocks(ranges):
+                block[inside] = value[outside]
+                key = ((ranges[0][0] + outside[0].start) // size, (ranges[1][0] + outside[1].start) // size)
+                if self.write_through is False and key not in self.chunk_dict['spilled']:
+                    self.chunk_dict['dirty'].add(key)
+
+    def __array__(self, dtype=None, copy=None):
+        # Materialises the whole world; only do this for layouts that fit in memory
+        return self[:, :] if dtype is None else self[:, :].astype(dtype)
+
+
+class map_trigger:
+    # Something that happens when an entity steps onto part of a map; register it with array_map.add_trigger().
+    # action(mapid, cord, plyr) is called with the tile being entered, and returning False stops the entity from entering it.
+    # condition() is checked before every call, so a trigger can follow quest state, e.g. condition=lambda: quest.stage == 2
+    def __init__(self, action, tag=None, condition=None, once=False):
+        self.trigger_dict = {'action': action, 'tag': tag, 'condition': condition, 'once': once}
+        self.trigger_dict['enabled'] = True
+        # ('cord', (y, x)), ('rect', (top, left, bottom, right)) or ('tile', til), set when the trigger is added to a map
+        self.trigger_dict['area'] = None
+
+    @property
+    def action(self):
+        return self.trigger_dict['action']
+
+    @property
+    def tag(self):
+        return self.trigger_dict['tag']
+
+    @property
+    def condition(self):
+        return self.trigger_dict['condition']
+
+    @property
+    def once(self):
+        return self.trigger_dict['once']
+
+    @property
+    def area(self):
+        return self.trigger_dict['area']
+
+    @property
+    def enabled(self):
+        return self.trigger_dict['enabled']
+
+    @enabled.setter
+    def enabled(self, value):
+        if value is True or value is False:
+            self.trigger_dict['enabled'] = value
+        else:
+            raise TypeError('Value must be True or False.')
+
+    def ready(self):
+        return self.enabled is True and (self.condition is None or self.condition() is True)
+
+    def fire(self, mapid, cord, plyr=False):
+        return self.action(mapid, cord, plyr)
+
+    def spend(self):
+        # Called once the entity has really stepped onto the tile, so a refused or blocked move does not use up a once trigger
+        if self.once is True:
+            self.enabled = False
+
+
 class array_map(ABC):
+    # Flags every tile type starts with. Override this in a subclass to change them for a whole map, or use set_flags() for single tiles.
+    tile_flags = {
+        Tiles.Player: Tile_Flags.walkable | Tile_Flags.scripted,
+        Tiles.Grass: Tile_Flags.walkable | Tile_Flags.scripted,
+        Tiles.Wall: Tile_Flags.walkable | Tile_Flags.scripted | Tile_Flags.opaque,
+        Tiles.Mountain: Tile_Flags.walkable | Tile_Flags.scripted | Tile_Flags.opaque,
+        Tiles.Cave: Tile_Flags.walkable | Tile_Flags.scripted,
+        Tiles.Water: Tile_Flags.walkable | Tile_Flags.scripted,
+        Tiles.Building: Tile_Flags.walkable | Tile_Flags.scripted | Tile_Flags.opaque,
+        Tiles.Lava: Tile_Flags.walkable | Tile_Flags.scripted | Tile_Flags.hazard,
+        Tiles.Dirt: Tile_Flags.walkable | Tile_Flags.scripted,
+        Tiles.Ice: Tile_Flags.walkable | Tile_Flags.scripted,
+        Tiles.Pit: Tile_Flags.walkable | Tile_Flags.scripted | Tile_Flags.hazard,
+    }
+    # Size in tiles of the smallest buckets that rectangle triggers are filed in; each level up doubles it
+    trigger_bucket = 16
+
     def __init__(self, name):
         self.map_dict = {'map_id': name}
         self.map_dict['map_layout'] = None
+        # (revision, packed Tile_Flags for every tile), built from the layout when first needed
+        self.map_dict['flag_layout'] = None
+        self.map_dict['flag_overrides'] = {}
+        # Goes up every time the layout changes, so that anything cached from it knows to rebuild
+        self.map_dict['revision'] = 0
+        # Boolean masks unpacked from the flag layer, stored with the revision they were built from
+        self.map_dict['masks'] = {}
+        # map_triggers filed by coordinate, by rectangle ({level: {bucket: triggers}}, see rect_buckets()) and by tile type
+        self.map_dict['triggers'] = {'cords': {}, 'rects': {}, 'tiles': {}, 'count': 0}
 
     @abstractmethod
     def send_data(self, til, plyr=False):
@@ -587,6 +1317,131 @@ class array_map(ABC):
         #         print('A wide river halts your progress down this path.')
         #     return False
 
+    def enter(self, cord, plyr=False, scripted=True, found=None):
+        # Whether an entity may step onto cord. send_data is asked first if the tile is scripted, so triggers only run for a move the
+        # tile itself accepts, and once triggers are only used up when every trigger lets the entity in.
+        # found is what triggers_at(cord) returned, for callers that already looked it up.
+        if scripted and self.send_data(cord, plyr) is not True:
+            return False
+
+        fired = self.fire_triggers(cord, plyr, found)
+        if fired is False:
+            return False
+
+        for trigger in fired:
+            trigger.spend()
+
+        return True
+
+    def fire_triggers(self, cord, plyr=False, found=None):
+        # Fire the ready triggers on a tile, returning the ones that fired, or False as soon as one refuses the entity.
+        # Nothing is used up here; call spend() on the fired triggers once the entity is sure to be on the tile.
+        fired = []
+        for trigger in (self.triggers_at(cord) if found is None else found):
+            if trigger.ready():
+                if trigger.fire(self, cord, plyr) is False:
+                    return False
+
+                fired.append(trigger)
+
+        return fired
+
+    @property
+    def has_triggers(self):
+        return self.map_dict['triggers']['count'] > 0
+
+    def add_trigger(self, trigger, cord=None, rect=None, til=None):
+        # File a map_trigger under exactly one of a coordinate, a (top, left, bottom, right) rectangle, or a tile type
+        if [cord, rect, til].count(None) != 2:
+            raise ValueError('A trigger needs exactly one of cord, rect or til.')
+
+        triggers = self.map_dict['triggers']
+        if cord is not None:
+            cord = (int(cord[Locate_Entity.y_cord]), int(cord[Locate_Entity.x_cord]))
+            triggers['cords'].setdefault(cord, []).append(trigger)
+            trigger.trigger_dict['area'] = ('cord', cord)
+        elif rect is not None:
+            rect = tuple(int(i) for i in rect)
+            for level, bucket in self.rect_buckets(rect):
+                triggers['rects'].setdefault(level, {}).setdefault(bucket, []).append(trigger)
+            trigger.trigger_dict['area'] = ('rect', rect)
+        else:
+            til = Tiles(til)
+            triggers['tiles'].setdefault(til, []).append(trigger)
+            trigger.trigger_dict['area'] = ('tile', til)
+
+        triggers['count'] += 1
+        return trigger
+
+    def remove_trigger(self, trigger):
+        triggers = self.map_dict['triggers']
+        kind, where = trigger.area
+        if kind == 'cord':
+            filed = [(triggers['cords'], where)]
+        elif kind == 'rect':
+            filed = [(triggers['rects'].setdefault(level, {}), bucket) for level, bucket in self.rect_buckets(where)]
+        else:
+            filed = [(triggers['tiles'], where)]
+
+        for store, key in filed:
+            store[key].remove(trigger)
+            if store[key] == []:
+                del store[key]
+
+        for level in [level for level, store in triggers['rects'].items() if store == {}]:
+            del triggers['rects'][level]
+
+        triggers['count'] -= 1
+        trigger.trigger_dict['area'] = None
+
+    def rect_buckets(self, rect):
+        # The buckets a (top, left, bottom, right) rectangle is filed in. Each rectangle goes in the smallest level of buckets where it
+        # covers no more than 2x2 of them, so a trigger over a whole region costs four entries instead of one per trigger_bucket square.
+        top, left, bottom, right = rect
+        bottom, right = max(bottom - 1, top), max(right - 1, left)
+        level, size = 0, self.trigger_bucket
+        while bottom // size - top // size > 1 or right // size - left // size > 1:
+            level, size = level + 1, size * 2
+
+        return [(level, (by, bx)) for by in range(top // size, bottom // size + 1) for bx in range(left // size, right // size + 1)]
+
+    def triggers(self, tag=None):
+        # Every trigger on the map, or only those with a tag
+        triggers = self.map_dict['triggers']
+        found = {}
+        for store in [triggers['cords'], triggers['tiles']] + list(triggers['rects'].values()):
+            for filed in store.values():
+                # Rectangle triggers are filed in every bucket they cover, so only keep each one once
+                found.update((id(trigger), trigger) for trigger in filed if tag is None or trigger.tag == tag)
+
+        return list(found.values())
+
+    def set_triggers(self, tag, enabled=True):
+        # Turn every trigger with a tag on or off at once, e.g. when a quest moves to its next stage
+        for trigger in self.triggers(tag):
+            trigger.enabled = enabled
+
+    def triggers_at(self, cord):
+        # Every trigger covering a tile, whether it is ready or not; a few dictionary lookups no matter how many the map has
+        triggers = self.map_dict['triggers']
+        if triggers['count'] == 0:
+            return []
+
+        y, x = int(cord[Locate_Entity.y_cord]), int(cord[Locate_Entity.x_cord])
+        found = list(triggers['cords'].get((y, x), ()))
+        # One lookup per level of rectangle buckets in use; a tile is only ever in one bucket of each level
+        for level, store in triggers['rects'].items():
+            size = self.trigger_bucket << level
+            for trigger in store.get((y // size, x // size), ()):
+                top, left, bottom, right = trigger.area[1]
+                if (top <= y < bottom) and (left <= x < right):
+                    found.append(trigger)
+
+        if triggers['tiles'] != {}:
+            found.extend(triggers['tiles'].get(int(self.layout[y, x]), ()))
+
+        return found
+
     def chk_tile_val(self, tile, to_match):
             if self.layout[tile[Locate_Entity.y_cord], tile[Locate_Entity.x_cord]] == to_match:
                 return True
@@ -603,8 +1458,1141 @@ class array_map(ABC):
 
     @layout.setter
     def layout(self, value):
-        assert isinstance(value, np.ndarray)
+        assert isinstance(value, (np.ndarray, chunked_layout))
+        if isinstance(value, np.ndarray):
+            value = self.compact_layout(value)
+
         self.map_dict['map_layout'] = value
+        self.map_dict['flag_layout'] = None
+        self.map_dict['revision'] += 1
+
+    @property
+    def revision(self):
+        return self.map_dict['revision']
+
+    def compact_layout(self, layout):
+        # Store one byte per tile, after checking that every value is a Tiles member
+        if layout.size > 0:
+            if not np.array_equal(layout, np.round(layout)) or layout.min() < 0 or layout.max() > max(Tiles):
+                raise ValueError('A map layout may only contain values from Tiles.')
+
+            valid = np.zeros(max(Tiles) + 1, dtype=bool)
+            valid[[til.value for til in Tiles]] = True
+            if not valid[layout.astype(np.intp)].all():
+                raise ValueError('A map layout may only contain values from Tiles.')
+
+        return layout.astype(np.uint8)
+
+    def set_tile(self, cord, til):
+        try:
+            til = Tiles(til)
+        except ValueError:
+            raise ValueError('A map layout may only contain values from Tiles.')
+
+        built = self.map_dict['flag_layout']
+        self.layout[cord[Locate_Entity.y_cord], cord[Locate_Entity.x_cord]] = til
+        self.map_dict['revision'] += 1
+        self.patch_flags(built, cord)
+
+    def patch_flags(self, built, cord):
+        # Carry a flag layer that was up to date before one tile changed over to the new revision. A layer being built on another
+        # thread (e.g. world_graph's preloader) while the tile changed keeps its older revision instead, so flags rebuilds it.
+        if built is not None and built[0] == self.revision - 1:
+            built[1][cord[Locate_Entity.y_cord], cord[Locate_Entity.x_cord]] = self.flags_at(cord)
+            self.map_dict['flag_layout'] = (self.revision, built[1])
+
+    @property
+    def flag_table(self):
+        # Tile value -> packed flags
+        table = np.zeros(256, dtype=np.uint8)
+        for til, flags in self.tile_flags.items():
+            table[til] = flags
+
+        return table
+
+    @property
+    def flags(self):
+        built = self.map_dict['flag_layout']
+        if (built is None) or (built[0] != self.revision):
+            # Tagged with the revision it started from, so a layer that missed a change made while it was being built is never used
+            revision = self.revision
+            flag_layout = self.flag_table[np.asarray(self.layout)]
+            for cord, flags in list(self.map_dict['flag_overrides'].items()):
+                flag_layout[cord] = flags
+
+            built = (revision, flag_layout)
+            self.map_dict['flag_layout'] = built
+
+        return built[1]
+
+    def flag_layer(self, flag):
+        # Unpack one flag into a boolean mask of the whole map
+        return (self.flags & flag) != 0
+
+    def flags_at(self, cord):
+        # Look up a single tile without building the whole flag layer, which matters for chunked layouts
+        cord = (cord[Locate_Entity.y_cord], cord[Locate_Entity.x_cord])
+        try:
+            return Tile_Flags(self.map_dict['flag_overrides'][cord])
+        except KeyError:
+            return Tile_Flags(int(self.tile_flags.get(int(self.layout[cord]), 0)))
+
+    def set_flags(self, cord, flags):
+        # Give one tile its own flags, no matter what tile type it is
+        cord = (cord[Locate_Entity.y_cord], cord[Locate_Entity.x_cord])
+        built = self.map_dict['flag_layout']
+        self.map_dict['flag_overrides'][cord] = Tile_Flags(flags)
+        self.map_dict['revision'] += 1
+        self.patch_flags(built, cord)
+
+    def flags_window(self, top, left, bottom, right):
+        # Packed flags for one block of the map, without building the flag layer for chunked layouts
+        if not isinstance(self.layout, chunked_layout):
+            return self.flags[top:bottom, left:right]
+
+        block = self.flag_table[self.layout[top:bottom, left:right]]
+        for (y, x), flags in self.map_dict['flag_overrides'].items():
+            if (top <= y < bottom) and (left <= x < right):
+                block[y - top, x - left] = flags
+
+        return block
+
+    def cached_mask(self, flag):
+        cached = self.map_dict['masks'].get(flag)
+        if (cached is None) or (cached[0] != self.revision):
+            cached = (self.revision, self.flag_layer(flag))
+            self.map_dict['masks'][flag] = cached
+
+        return cached[1]
+
+    @property
+    def passable(self):
+        # True wherever an entity is allowed to stand
+        return self.cached_mask(Tile_Flags.walkable)
+
+    @property
+    def scripted(self):
+        # True wherever send_data has to be asked before an entity can stand there
+        return self.cached_mask(Tile_Flags.scripted)
+
+    def set_passable(self, cord, value=True):
+        flags = self.flags_at(cord)
+        self.set_flags(cord, (flags | Tile_Flags.walkable) if value is True else (flags & ~Tile_Flags.walkable))
+
+    def set_scripted(self, cord, value=True):
+        flags = self.flags_at(cord)
+        self.set_flags(cord, (flags | Tile_Flags.scripted) if value is True else (flags & ~Tile_Flags.scripted))
+
+    def clear_flags(self, cord):
+        cord = (cord[Locate_Entity.y_cord], cord[Locate_Entity.x_cord])
+        self.map_dict['flag_overrides'].pop(cord, None)
+        self.map_dict['flag_layout'] = None
+        self.map_dict['revision'] += 1
+
+#
+# Pathfinding #
+#
+
+
+class path_finder:
+    # Cost of stepping onto each tile type. None means the tile is never walked through, even if the map allows it.
+    tile_costs = {
+        Tiles.Player: 1,
+        Tiles.Grass: 1,
+        Tiles.Wall: None,
+        Tiles.Mountain: 4,
+        Tiles.Cave: 1,
+        Tiles.Water: 4,
+        Tiles.Building: 1,
+        Tiles.Lava: 8,
+        Tiles.Dirt: 1,
+        Tiles.Ice: 2,
+        Tiles.Pit: 8,
+    }
+    # Costs are read in square blocks of this many tiles the first time a search reaches them. Chunked layouts use their chunk size
+    # instead, so a search only pages in the chunks it actually walks through.
+    block_size = 64
+
+    def __init__(self, max_cached=4096, max_blocks=256):
+        from weakref import WeakKeyDictionary
+        self.path_dict = {'maps': WeakKeyDictionary(), 'max_cached': max_cached, 'max_blocks': max_blocks}
+
+    def map_cache(self, mapid):
+        # Everything cached for a map is thrown away as soon as its layout changes
+        cache = self.path_dict['maps'].get(mapid)
+        if (cache is None) or (cache['revision'] != mapid.revision):
+            cache = {'revision': mapid.revision, 'shape': mapid.layout.shape}
+            cache['block_size'] = mapid.layout.chunk_size if isinstance(mapid.layout, chunked_layout) else self.block_size
+            # (block y, block x) -> np.ndarray of costs, oldest first
+            cache['blocks'] = OrderedDict()
+            cache['paths'] = OrderedDict()
+            cache['fields'] = OrderedDict()
+            self.path_dict['maps'][mapid] = cache
+
+        return cache
+
+    def remember(self, store, key, value):
+        store[key] = value
+        if len(store) > self.path_dict['max_cached']:
+            store.popitem(last=False)
+
+        return value
+
+    @property
+    def cost_table(self):
+        # Tile value -> cost, inf for tiles that are never walked through
+        table = np.full(256, np.inf)
+        for til, cost in self.tile_costs.items():
+            if cost is not None:
+                table[til] = cost
+
+        return table
+
+    @property
+    def min_cost(self):
+        # The cheapest tile anywhere, which keeps the A* heuristic from ever overestimating
+        return min([cost for cost in self.tile_costs.values() if cost is not None], default=1)
+
+    def block_costs(self, mapid, cache, by, bx):
+        blocks = cache['blocks']
+        try:
+            return blocks[(by, bx)]
+        except KeyError:
+            size = cache['block_size']
+            height, width = cache['shape']
+            top, left = by * size, bx * size
+            bottom, right = min(top + size, height), min(left + size, width)
+
+            block = self.cost_table[np.asarray(mapid.layout[top:bottom, left:right])]
+            block[(mapid.flags_window(top, left, bottom, right) & Tile_Flags.walkable) == 0] = np.inf
+            blocks[(by, bx)] = block
+
+            # Drop the oldest blocks, so a long session does not slowly end up holding the costs of the whole world
+            while len(blocks) > self.path_dict['max_blocks']:
+                blocks.popitem(last=False)
+
+            return block
+
+    def cost_reader(self, mapid, cache):
+        # cost_at(y, x) for searches, reading in a block of costs whenever it reaches one it does not have yet
+        blocks = cache['blocks']
+        size = cache['block_size']
+
+        def cost_at(y, x):
+            by, bx = y // size, x // size
+            block = blocks.get((by, bx))
+            if block is None:
+                block = self.block_costs(mapid, cache, by, bx)
+
+            return block.item(y - by * size, x - bx * size)
+
+        return cost_at
+
+    def window_costs(self, mapid, cache, top, left, bottom, right):
+        # Costs for one rectangle of the map, put together from the blocks it covers
+        size = cache['block_size']
+        costs = np.empty((bottom - top, right - left))
+        for by in range(top // size, -(-bottom // size)):
+            for bx in range(left // size, -(-right // size)):
+                block = self.block_costs(mapid, cache, by, bx)
+                y0, x0 = by * size, bx * size
+                t, b = max(top, y0), min(bottom, y0 + block.shape[0])
+                l, r = max(left, x0), min(right, x0 + block.shape[1])
+                costs[t - top:b - top, l - left:r - left] = block[t - y0:b - y0, l - x0:r - x0]
+
+        return costs
+
+    def costs(self, mapid):
+        # Cost of every tile on the map; this reads the whole map, so only use it on maps that fit in memory
+        cache = self.map_cache(mapid)
+        return self.window_costs(mapid, cache, 0, 0, *cache['shape'])
+
+    def search_window(self, cache, cords, window):
+        # (top, left, bottom, right) a search may cover: the whole map, or window tiles around the box holding cords
+        height, width = cache['shape']
+        if window is None:
+            return 0, 0, height, width
+
+        ys = [cord[0] for cord in cords]
+        xs = [cord[1] for cord in cords]
+        return max(min(ys) - window, 0), max(min(xs) - window, 0), min(max(ys) + window + 1, height), min(max(xs) + window + 1, width)
+
+    def neighbours(self, cost_at, bounds, y, x):
+        # Yield (y, x, distance) for each walkable tile around (y, x) inside bounds, without cutting across blocked corners
+        top, left, bottom, right = bounds
+        for dy, dx in direction_offsets.values():
+            ny, nx = y + dy, x + dx
+            if (top <= ny < bottom) and (left <= nx < right) and cost_at(ny, nx) != np.inf:
+                if dy == 0 or dx == 0:
+                    yield ny, nx, 1
+                elif cost_at(ny, x) != np.inf and cost_at(y, nx) != np.inf:
+                    yield ny, nx, 2 ** .5
+
+    def find_path(self, mapid, start, goal, max_cost=None, window=None):
+        # A* search; returns the list of coordinates after start up to and including goal, or None if goal cannot be reached.
+        # max_cost gives up on paths that would cost more, and window keeps the search within that many tiles of the box around start and goal.
+        start = (int(start[Locate_Entity.y_cord]), int(start[Locate_Entity.x_cord]))
+        goal = (int(goal[Locate_Entity.y_cord]), int(goal[Locate_Entity.x_cord]))
+
+        cache = self.map_cache(mapid)
+        key = (start, goal, max_cost, window)
+        try:
+            cache['paths'].move_to_end(key)
+            path = cache['paths'][key]
+            return None if path is None else [list(cord) for cord in path]
+        except KeyError:
+            pass
+
+        from heapq import heappush, heappop
+
+        cost_at = self.cost_reader(mapid, cache)
+        bounds = self.search_window(cache, (start, goal), window)
+        top, left, bottom, right = bounds
+        min_cost = self.min_cost
+        limit = np.inf if max_cost is None else max_cost
+
+        def heuristic(y, x):
+            # Octile distance, scaled by the cheapest tile so it never overestimates
+            dy = abs(y - goal[0])
+            dx = abs(x - goal[1])
+            return min_cost * (max(dy, dx) + (2 ** .5 - 1) * min(dy, dx))
+
+        path = None
+        if (top <= goal[0] < bottom) and (left <= goal[1] < right) and (top <= start[0] < bottom) and (left <= start[1] < right) and cost_at(*goal) != np.inf:
+            came_from = {start: None}
+            spent = {start: 0}
+            frontier = [(heuristic(*start), 0, start)]
+
+            while frontier != []:
+                total, so_far, node = heappop(frontier)
+                # total never overestimates, so once it passes max_cost every path left does too
+                if total > limit:
+                    break
+
+                if so_far > spent[node]:
+                    continue
+
+                if node == goal:
+                    path = []
+                    while node != start:
+                        path.append(node)
+                        node = came_from[node]
+                    path.reverse()
+                    break
+
+                for ny, nx, distance in self.neighbours(cost_at, bounds, *node):
+                    new_cost = so_far + cost_at(ny, nx) * distance
+                    if new_cost < spent.get((ny, nx), np.inf):
+                        spent[(ny, nx)] = new_cost
+                        came_from[(ny, nx)] = node
+                        heappush(frontier, (new_cost + heuristic(ny, nx), new_cost, (ny, nx)))
+
+        self.remember(cache['paths'], key, path)
+        return None if path is None else [list(cord) for cord in path]
+
+    def path_cost(self, mapid, start, path):
+        # Total cost of walking a path from find_path, added up the same way find_path does
+        cost_at = self.cost_reader(mapid, self.map_cache(mapid))
+        y, x = start[Locate_Entity.y_cord], start[Locate_Entity.x_cord]
+        total = 0
+        for ny, nx in path:
+            total += cost_at(ny, nx) * (2 ** .5 if ny != y and nx != x else 1)
+            y, x = ny, nx
+
+        return float(total)
+
+    def step_toward(self, mapid, start, goal, max_cost=None, window=None):
+        # The direction of the first step along the best path, or None if there is nowhere to go
+        path = self.find_path(mapid, start, goal, max_cost, window)
+        if not path:
+            return None
+
+        return offset_directions[(path[0][Locate_Entity.y_cord] - start[Locate_Entity.y_cord], path[0][Locate_Entity.x_cord] - start[Locate_Entity.x_cord])]
+
+    def field_cache(self, mapid, targets, max_cost, window):
+        # (top, left, distances, flow) for a set of targets, searching only as far as max_cost and window allow
+        targets = tuple(sorted((int(cord[Locate_Entity.y_cord]), int(cord[Locate_Entity.x_cord])) for cord in targets))
+
+        cache = self.map_cache(mapid)
+        key = (targets, max_cost, window)
+        try:
+            cache['fields'].move_to_end(key)
+            return cache['fields'][key]
+        except KeyError:
+            pass
+
+        from heapq import heappush, heappop
+
+        # Dijkstra from every target at once; each tile holds the cost of reaching the nearest target (inf if it cannot, or is too far)
+        cost_at = self.cost_reader(mapid, cache)
+        bounds = self.search_window(cache, targets, window) if targets != () else (0, 0, 0, 0)
+        top, left, bottom, right = bounds
+        width = right - left
+        limit = np.inf if max_cost is None else max_cost
+        spent = [np.inf] * ((bottom - top) * width)
+        frontier = []
+        for y, x in targets:
+            if (top <= y < bottom) and (left <= x < right):
+                spent[(y - top) * width + x - left] = 0
+                frontier.append((0, y, x))
+
+        while frontier != []:
+            total, y, x = heappop(frontier)
+            if total > spent[(y - top) * width + x - left]:
+                continue
+
+            # The search runs backwards from the targets, so each step costs the tile being stepped onto, which is (y, x)
+            here = cost_at(y, x)
+            for ny, nx, distance in self.neighbours(cost_at, bounds, y, x):
+                new_cost = total + here * distance
+                index = (ny - top) * width + nx - left
+                if new_cost < spent[index] and new_cost <= limit:
+                    spent[index] = new_cost
+                    heappush(frontier, (new_cost, ny, nx))
+
+        field = np.array(spent).reshape(bottom - top, width)
+        return self.remember(cache['fields'], key, (top, left, field, self.flow_directions(field, self.window_costs(mapid, cache, *bounds))))
+
+    def distance_field(self, mapid, targets, max_cost=None):
+        # Cost of reaching the nearest target from every tile of the map (inf if it cannot, or if it costs more than max_cost)
+        return self.field_cache(mapid, targets, max_cost, None)[2]
+
+    def distance_window(self, mapid, targets, window, max_cost=None):
+        # Like distance_field, but only searching and returning the tiles within window of the targets, as (top, left, field)
+        return self.field_cache(mapid, targets, max_cost, window)[:3]
+
+    def flow_directions(self, field, costs):
+        # For every tile, the direction of the first step on its cheapest path to a target (0 on targets and unreachable tiles)
+        height, width = field.shape
+        padded_field = np.pad(field, 1, constant_values=np.inf)
+        padded_costs = np.pad(costs, 1, constant_values=np.inf)
+        blocked = ~np.isfinite(padded_costs)
+
+        best = np.full(field.shape, np.inf)
+        flow = np.zeros(field.shape, dtype=np.uint8)
+        for direction, (dy, dx) in direction_offsets.items():
+            rows = slice(1 + dy, 1 + dy + height)
+            clmns = slice(1 + dx, 1 + dx + width)
+            total = padded_field[rows, clmns] + padded_costs[rows, clmns] * (2 ** .5 if dy != 0 and dx != 0 else 1)
+            if dy != 0 and dx != 0:
+                # Do not cut across blocked corners
+                total[blocked[rows, 1:1 + width] | blocked[1:1 + height, clmns]] = np.inf
+
+            better = total < best
+            best[better] = total[better]
+            flow[better] = direction
+
+        flow[(field == 0) | ~np.isfinite(field) | ~np.isfinite(costs)] = 0
+        return flow
+
+    def flow_field(self, mapid, targets, max_cost=None):
+        # Shared by any number of entities heading for the same targets; look a tile up with flow_step()
+        return self.field_cache(mapid, targets, max_cost, None)[3]
+
+    def flow_window(self, mapid, targets, window, max_cost=None):
+        # Like flow_field, but only for the tiles within window of the targets, as (top, left, flow); pass top and left on to flow_step()
+        top, left, field, flow = self.field_cache(mapid, targets, max_cost, window)
+        return top, left, flow
+
+    def flow_step(self, flow, cord, top=0, left=0):
+        y, x = cord[Locate_Entity.y_cord] - top, cord[Locate_Entity.x_cord] - left
+        if not ((0 <= y < flow.shape[0]) and (0 <= x < flow.shape[1])):
+            return None
+
+        direction = flow[y, x]
+        return None if direction == 0 else Directions(direction)
+
+#
+# Field of View #
+#
+
+
+class field_of_view:
+    # Octant multipliers that let one shadowcasting routine cover all eight octants around the viewer
+    octants = ((1, 0, 0, -1, -1, 0, 0, 1), (0, 1, -1, 0, 0, -1, 1, 0), (0, 1, 1, 0, 0, -1, -1, 0), (1, 0, 0, 1, -1, 0, 0, -1))
+    # Explored tiles are kept in square chunks of this size, and only for chunks that have been seen at all
+    explored_chunk = 64
+
+    def __init__(self, radius=8, max_cached=1024):
+        from weakref import WeakKeyDictionary
+        self.sight_dict = {'radius': radius, 'max_cached': max_cached, 'maps': WeakKeyDictionary()}
+
+    @property
+    def radius(self):
+        return self.sight_dict['radius']
+
+    @radius.setter
+    def radius(self, value):
+        self.sight_dict['radius'] = value
+
+    def map_cache(self, mapid):
+        # Views are thrown away when the layout changes, but what has been explored is kept
+        cache = self.sight_dict['maps'].get(mapid)
+        if cache is None:
+            # explored maps (chunk y, chunk x) -> boolean mask of that chunk, for the layout shape it was made for
+            cache = {'revision': None, 'views': OrderedDict(), 'explored': {}, 'explored_shape': None, 'last_reveal': None}
+            self.sight_dict['maps'][mapid] = cache
+        if cache['revision'] != mapid.revision:
+            cache['revision'] = mapid.revision
+            cache['views'] = OrderedDict()
+            cache['last_reveal'] = None
+
+        return cache
+
+    def compute(self, mapid, cord, radius=None):
+        # Returns (top, left, visible) where visible is a boolean mask of the square around cord that the viewer can see
+        radius = self.radius if radius is None else radius
+        y, x = int(cord[Locate_Entity.y_cord]), int(cord[Locate_Entity.x_cord])
+
+        cache = self.map_cache(mapid)
+        try:
+            cache['views'].move_to_end((y, x, radius))
+            return cache['views'][(y, x, radius)]
+        except KeyError:
+            pass
+
+        height, width = mapid.layout.shape
+        top, left = max(y - radius, 0), max(x - radius, 0)
+        bottom, right = min(y + radius + 1, height), min(x + radius + 1, width)
+
+        opaque = ((mapid.flags_window(top, left, bottom, right) & Tile_Flags.opaque) != 0).tolist()
+        visible = np.zeros((bottom - top, right - left), dtype=bool)
+        if visible.size > 0:
+            visible[y - top, x - left] = True
+
+            # Work in the block's own coordinates
+            for xx, xy, yx, yy in zip(*self.octants):
+                self.cast_light(opaque, visible, x - left, y - top, 1, 1.0, 0.0, radius, xx, xy, yx, yy)
+
+        view = (top, left, visible)
+        cache['views'][(y, x, radius)] = view
+        if len(cache['views']) > self.sight_dict['max_cached']:
+            cache['views'].popitem(last=False)
+
+        return view
+
+    def cast_light(self, opaque, visible, cx, cy, row, start, end, radius, xx, xy, yx, yy):
+        # Recursive shadowcasting over one octant; tiles outside the block count as opaque
+        if start < end:
+            return
+
+        height, width = visible.shape
+        radius_squared = radius * radius
+        new_start = start
+        for j in range(row, radius + 1):
+            dx, dy = -j - 1, -j
+            blocked = False
+            while dx <= 0:
+                dx += 1
+                X, Y = cx + dx * xx + dy * xy, cy + dx * yx + dy * yy
+                l_slope, r_slope = (dx - .5) / (dy + .5), (dx + .5) / (dy - .5)
+                if start < r_slope:
+                    continue
+                elif end > l_slope:
+                    break
+
+                inside = (0 <= X < width) and (0 <= Y < height)
+                if inside and dx * dx + dy * dy <= radius_squared:
+                    visible[Y, X] = True
+
+                wall = (not inside) or opaque[Y][X]
+                if blocked:
+                    if wall:
+                        new_start = r_slope
+                        continue
+                    else:
+                        blocked = False
+                        start = new_start
+                elif wall and j < radius:
+                    # This tile starts a shadow; scan the part of the next row that is still lit
+                    blocked = True
+                    self.cast_light(opaque, visible, cx, cy, j + 1, start, l_slope, radius, xx, xy, yx, yy)
+                    new_start = r_slope
+
+            if blocked:
+                break
+
+    def visible(self, mapid, cord, radius=None):
+        # The same as compute(), as a mask of the whole map
+        top, left, block = self.compute(mapid, cord, radius)
+        mask = np.zeros(mapid.layout.shape, dtype=bool)
+        mask[top:top + block.shape[0], left:left + block.shape[1]] = block
+
+        return mask
+
+    def explored_chunks(self, mapid):
+        # The map's explored chunks, started over if the layout has been replaced with one of a different size
+        cache = self.map_cache(mapid)
+        if cache['explored_shape'] != tuple(mapid.layout.shape):
+            cache['explored'] = {}
+            cache['explored_shape'] = tuple(mapid.layout.shape)
+            cache['last_reveal'] = None
+
+        return cache['explored']
+
+    def chunk_ranges(self, top, left, bottom, right):
+        # Yield each explored chunk overlapping a rectangle, with the overlap in chunk and in rectangle coordinates
+        size = self.explored_chunk
+        for cy in range(top // size, -(-bottom // size)):
+            for cx in range(left // size, -(-right // size)):
+                t, b = max(top, cy * size), min(bottom, (cy + 1) * size)
+                l, r = max(left, cx * size), min(right, (cx + 1) * size)
+                yield (cy, cx), (slice(t - cy * size, b - cy * size), slice(l - cx * size, r - cx * size)), (slice(t - top, b - top), slice(l - left, r - left))
+
+    def reveal(self, mapid, cord, radius=None):
+        # Add what can be seen from cord to the map's explored tiles and return it as (top, left, visible), like compute().
+        # Nothing is recomputed if the viewer has not moved.
+        chunks = self.explored_chunks(mapid)
+        cache = self.map_cache(mapid)
+        key = (int(cord[Locate_Entity.y_cord]), int(cord[Locate_Entity.x_cord]), self.radius if radius is None else radius)
+        view = self.compute(mapid, cord, radius)
+
+        if cache['last_reveal'] != key:
+            top, left, block = view
+            size = self.explored_chunk
+            for chunk, inside, outside in self.chunk_ranges(top, left, top + block.shape[0], left + block.shape[1]):
+                seen = block[outside]
+                if seen.any():
+                    if chunk not in chunks:
+                        chunks[chunk] = np.zeros((size, size), dtype=bool)
+                    chunks[chunk][inside] |= seen
+            cache['last_reveal'] = key
+
+        return view
+
+    def explored(self, mapid, top=0, left=0, bottom=None, right=None):
+        # Boolean mask of the explored tiles in a rectangle of the map; the whole map unless a rectangle is given
+        chunks = self.explored_chunks(mapid)
+        height, width = mapid.layout.shape
+        top, left = max(top, 0), max(left, 0)
+        bottom = height if bottom is None else min(bottom, height)
+        right = width if right is None else min(right, width)
+
+        mask = np.zeros((max(bottom - top, 0), max(right - left, 0)), dtype=bool)
+        if mask.size > 0:
+            for chunk, inside, outside in self.chunk_ranges(top, left, bottom, right):
+                if chunk in chunks:
+                    mask[outside] = chunks[chunk][inside]
+
+        return mask
+
+    def is_explored(self, mapid, cord):
+        y, x = int(cord[Locate_Entity.y_cord]), int(cord[Locate_Entity.x_cord])
+        chunk = self.explored_chunks(mapid).get((y // self.explored_chunk, x // self.explored_chunk))
+        return chunk is not None and bool(chunk[y % self.explored_chunk, x % self.explored_chunk])
+
+    def forget(self, mapid):
+        self.sight_dict['maps'].pop(mapid, None)
+
+#
+# Spatial Index #
+#
+
+
+class spatial_index:
+    # Keeps every entity in a grid of buckets for each map, so lookups only look at entities nearby.
+    # entity.set_loc() keeps it up to date, so entities moved any other way must be passed to place() afterwards.
+    def __init__(self, bucket_size=16):
+        from weakref import WeakKeyDictionary
+        self.index_dict = {'bucket_size': bucket_size}
+        # mapid -> {bucket: entities}
+        self.index_dict['buckets'] = {}
+        # mapid -> entities
+        self.index_dict['members'] = {}
+        # entity -> (mapid, bucket) it is filed under
+        self.index_dict['placed'] = WeakKeyDictionary()
+
+    @property
+    def bucket_size(self):
+        return self.index_dict['bucket_size']
+
+    def bucket(self, cord):
+        return (int(cord[Locate_Entity.y_cord]) // self.bucket_size, int(cord[Locate_Entity.x_cord]) // self.bucket_size)
+
+    def place(self, thing):
+        from weakref import WeakSet
+
+        mapid = thing.location[Locate_Entity.mapid]
+        try:
+            key = (mapid, self.bucket(thing.location[Locate_Entity.coordinates]))
+            hash(mapid)
+        except (TypeError, ValueError, IndexError):
+            # Entities without a usable location are left out of the index
+            self.forget(thing)
+            return
+
+        old_key = self.index_dict['placed'].get(thing)
+        if old_key is not None and old_key[0] is mapid and old_key[1] == key[1]:
+            return
+
+        self.forget(thing)
+        self.index_dict['buckets'].setdefault(mapid, {}).setdefault(key[1], WeakSet()).add(thing)
+        self.index_dict['members'].setdefault(mapid, WeakSet()).add(thing)
+        self.index_dict['placed'][thing] = key
+
+    def forget(self, thing):
+        key = self.index_dict['placed'].pop(thing, None)
+        if key is None:
+            return
+
+        mapid, bucket = key
+        buckets = self.index_dict['buckets'][mapid]
+        buckets[bucket].discard(thing)
+        if len(buckets[bucket]) == 0:
+            del buckets[bucket]
+
+        self.index_dict['members'][mapid].discard(thing)
+        if len(self.index_dict['members'][mapid]) == 0:
+            del self.index_dict['members'][mapid]
+            del self.index_dict['buckets'][mapid]
+
+    def on_map(self, mapid):
+        return list(self.index_dict['members'].get(mapid, ()))
+
+    def at(self, mapid, cord):
+        cord = [int(cord[Locate_Entity.y_cord]), int(cord[Locate_Entity.x_cord])]
+        bucket = self.index_dict['buckets'].get(mapid, {}).get(self.bucket(cord), ())
+
+        return [thing for thing in bucket if list(thing.location[Locate_Entity.coordinates]) == cord]
+
+    def within(self, mapid, cord, radius):
+        # Every entity whose straight-line distance from cord is at most radius
+        buckets = self.index_dict['buckets'].get(mapid, {})
+        y, x = int(cord[Locate_Entity.y_cord]), int(cord[Locate_Entity.x_cord])
+        top, left = self.bucket((y - radius, x - radius))
+        bottom, right = self.bucket((y + radius, x + radius))
+
+        found = []
+        for by in range(top, bottom + 1):
+            for bx in range(left, right + 1):
+                for thing in buckets.get((by, bx), ()):
+                    ty, tx = thing.location[Locate_Entity.coordinates]
+                    if (ty - y) ** 2 + (tx - x) ** 2 <= radius ** 2:
+                        found.append(thing)
+
+        return found
+
+#
+# World Graph #
+#
+
+
+class world_graph:
+    # Every map in the game and the portals (caves, doors, map edges...) that join them.
+    # Set it as loc_man.world and entities that step onto a portal are sent to its other end.
+    # leg_max_cost and leg_window are passed on to path_finder.find_path() for every walk between portals, so routing across big maps stays cheap.
+    def __init__(self, preload_radius=8, finder=None, leg_max_cost=None, leg_window=None):
+        self.world_dict = {'maps': [], 'preload_radius': preload_radius, 'leg_max_cost': leg_max_cost, 'leg_window': leg_window}
+        # mapid -> {portal coordinate: (destination mapid, destination coordinate)}
+        self.world_dict['portals'] = {}
+        self.world_dict['finder'] = path_finder() if finder is None else finder
+        # (mapid, coordinate) -> map revision it was last preloaded at
+        self.world_dict['preloaded'] = {}
+        # Queue feeding the background loader, started the first time it is needed
+        self.world_dict['loader'] = None
+
+    @property
+    def maps(self):
+        return list(self.world_dict['maps'])
+
+    @property
+    def finder(self):
+        return self.world_dict['finder']
+
+    @property
+    def preload_radius(self):
+        return self.world_dict['preload_radius']
+
+    @preload_radius.setter
+    def preload_radius(self, value):
+        self.world_dict['preload_radius'] = value
+
+    def add_map(self, mapid):
+        if not any(known is mapid for known in self.world_dict['maps']):
+            self.world_dict['maps'].append(mapid)
+            self.world_dict['portals'].setdefault(mapid, {})
+
+        return mapid
+
+    def add_portal(self, mapid, cord, dest, dest_cord, two_way=True):
+        # Stepping onto cord on mapid leads to dest_cord on dest; two-way portals also lead back
+        cord = (int(cord[Locate_Entity.y_cord]), int(cord[Locate_Entity.x_cord]))
+        dest_cord = (int(dest_cord[Locate_Entity.y_cord]), int(dest_cord[Locate_Entity.x_cord]))
+        self.add_map(mapid)
+        self.add_map(dest)
+
+        self.world_dict['portals'][mapid][cord] = (dest, dest_cord)
+        if two_way is True:
+            self.world_dict['portals'][dest][dest_cord] = (mapid, cord)
+
+    def remove_portal(self, mapid, cord, two_way=True):
+        cord = (int(cord[Locate_Entity.y_cord]), int(cord[Locate_Entity.x_cord]))
+        arrival = self.world_dict['portals'].get(mapid, {}).pop(cord, None)
+        if arrival is not None and two_way is True:
+            dest, dest_cord = arrival
+            if self.world_dict['portals'][dest].get(dest_cord) == (mapid, cord):
+                del self.world_dict['portals'][dest][dest_cord]
+
+    def portals(self, mapid):
+        return dict(self.world_dict['portals'].get(mapid, {}))
+
+    def portal_at(self, mapid, cord):
+        # Where a portal leads as (mapid, [y, x]), or None if there is no portal at cord
+        try:
+            arrival = self.world_dict['portals'][mapid].get((int(cord[Locate_Entity.y_cord]), int(cord[Locate_Entity.x_cord])))
+        except (KeyError, TypeError):
+            return None
+
+        return None if arrival is None else (arrival[0], list(arrival[1]))
+
+    def linked_maps(self, mapid):
+        # Maps that can be reached straight through one of this map's portals
+        linked = []
+        for dest, dest_cord in self.world_dict['portals'].get(mapid, {}).values():
+            if not any(known is dest for known in linked):
+                linked.append(dest)
+
+        return linked
+
+    def leg(self, mapid, start, goal):
+        # Best path and its cost between two tiles of the same map; the path is None when goal cannot be reached
+        path = self.finder.find_path(mapid, start, goal, self.world_dict['leg_max_cost'], self.world_dict['leg_window'])
+        if path is None:
+            return None, np.inf
+
+        return path, self.finder.path_cost(mapid, start, path)
+
+    def route(self, mapid, start, goal_map, goal):
+        # Cheapest way from start on mapid to goal on goal_map, walking and taking portals.
+        # Returns a list of (mapid, path) legs, where each leg after the first starts where the last portal led, or None if goal cannot be reached.
+        from heapq import heappush, heappop
+        from itertools import count
+
+        start = (int(start[Locate_Entity.y_cord]), int(start[Locate_Entity.x_cord]))
+        goal = (int(goal[Locate_Entity.y_cord]), int(goal[Locate_Entity.x_cord]))
+
+        # Nodes are the places an entity can be standing: the start, and every tile a portal leads to. None stands for the goal.
+        begin = (mapid, start)
+        spent = {begin: 0}
+        came_from = {begin: None}
+        tie = count()
+        frontier = [(0, next(tie), begin)]
+
+        while frontier != []:
+            total, _, node = heappop(frontier)
+            if total > spent[node]:
+                continue
+
+            if node is None:
+                break
+
+            here, cord = node
+            steps = [(portal, arrival) for portal, arrival in self.world_dict['portals'].get(here, {}).items() if portal != cord]
+            if here is goal_map:
+                steps.append((goal, None))
+
+            for portal, arrival in steps:
+                cost = self.leg(here, cord, portal)[1]
+                if cost == np.inf:
+                    continue
+
+                if total + cost < spent.get(arrival, np.inf):
+                    spent[arrival] = total + cost
+                    came_from[arrival] = (node, portal)
+                    heappush(frontier, (total + cost, next(tie), arrival))
+
+        if None not in came_from:
+            return None
+
+        # Walk back from the goal, then fill each leg in with its path
+        legs = []
+        node = None
+        while came_from[node] is not None:
+            previous, portal = came_from[node]
+            here, cord = previous
+            legs.append((here, self.leg(here, cord, portal)[0]))
+            node = previous
+
+        legs.reverse()
+        return legs
+
+    def route_cost(self, mapid, start, goal_map, goal):
+        legs = self.route(mapid, start, goal_map, goal)
+        if legs is None:
+            return np.inf
+
+        total = 0
+        cord = start
+        for here, path in legs:
+            total += self.finder.path_cost(here, cord, path)
+            arrival = self.portal_at(here, path[-1]) if path != [] else None
+            cord = None if arrival is None else arrival[1]
+
+        return total
+
+    def preload_near(self, mapid, cord):
+        # Queue the other end of every portal within preload_radius of cord to be loaded in the background
+        y, x = int(cord[Locate_Entity.y_cord]), int(cord[Locate_Entity.x_cord])
+        for (py, px), (dest, dest_cord) in self.world_dict['portals'].get(mapid, {}).items():
+            if max(abs(py - y), abs(px - x)) <= self.preload_radius:
+                key = (dest, dest_cord)
+                if self.world_dict['preloaded'].get(key) != dest.revision:
+                    self.world_dict['preloaded'][key] = dest.revision
+                    self.loader().put(key)
+
+    def preload(self, mapid, cord):
+        # Page in the chunks around where an entity will arrive, or build the masks moving about the map needs
+        if isinstance(mapid.layout, chunked_layout):
+            mapid.layout.prefetch(cord)
+        else:
+            mapid.passable
+            mapid.scripted
+
+    def loader(self):
+        if self.world_dict['loader'] is None:
+            from queue import Queue
+            from threading import Thread
+
+            jobs = Queue()
+
+            def work():
+                while True:
+                    mapid, cord = jobs.get()
+                    try:
+                        self.preload(mapid, cord)
+                    except Exception as e:
+                        debug_info(e, 'Could not preload map ' + str(mapid.id))
+                    jobs.task_done()
+
+            Thread(target=work, daemon=True).start()
+            self.world_dict['loader'] = jobs
+
+        return self.world_dict['loader']
+
+    def wait_for_preload(self):
+        # Block until everything queued so far has loaded, e.g. behind a loading screen
+        if self.world_dict['loader'] is not None:
+            self.world_dict['loader'].join()
+
+#
+# Entity Store #
+#
+
+
+class entity_store:
+    # Stats, positions and maps for many entities at once, kept column by column in NumPy arrays so whole crowds can be updated in one call.
+    # Each row is one entity; entity_view gives a row the same name/location/stats API as an entity. Rows are not in the spatial index.
+    def __init__(self, capacity=1024):
+        self.store_dict = {'size': 0, 'free': []}
+        self.store_dict['stats'] = np.zeros((capacity, len(Stat_Columns)))
+        self.store_dict['cords'] = np.zeros((capacity, 2), dtype=np.intp)
+        # Index into map_list for each row, -1 for no map
+        self.store_dict['maps'] = np.full(capacity, -1, dtype=np.int32)
+        self.store_dict['alive'] = np.zeros(capacity, dtype=bool)
+        self.store_dict['names'] = [None] * capacity
+        self.store_dict['map_list'] = []
+        self.store_dict['map_codes'] = {}
+        # Active buffs: the row each is on, the Stat_Sheet changes it made, and how many ticks are left before they are undone
+        self.store_dict['buff_rows'] = np.zeros(0, dtype=np.intp)
+        self.store_dict['buff_changes'] = np.zeros((0, len(Stat_Sheet)))
+        self.store_dict['buff_ticks'] = np.zeros(0, dtype=np.intp)
+
+    @property
+    def stats(self):
+        # One row per entity, one column per Stat_Columns member
+        return self.store_dict['stats']
+
+    @property
+    def cords(self):
+        return self.store_dict['cords']
+
+    @property
+    def maps(self):
+        return self.store_dict['maps']
+
+    @property
+    def alive(self):
+        return self.store_dict['alive']
+
+    @property
+    def rows(self):
+        return np.flatnonzero(self.alive)
+
+    def __len__(self):
+        return int(np.count_nonzero(self.alive))
+
+    def map_code(self, mapid):
+        if mapid is None:
+            return -1
+
+        try:
+            return self.store_dict['map_codes'][mapid]
+        except KeyError:
+            self.store_dict['map_list'].append(mapid)
+            self.store_dict['map_codes'][mapid] = len(self.store_dict['map_list']) - 1
+            return self.store_dict['map_codes'][mapid]
+
+    def map_at(self, code):
+        return None if code < 0 else self.store_dict['map_list'][code]
+
+    def grow(self, needed):
+        # Double the columns until there is room for 'needed' rows
+        capacity = len(self.alive)
+        if needed <= capacity:
+            return
+
+        while capacity < needed:
+            capacity *= 2
+
+        for key, fill in (('stats', 0), ('cords', 0), ('maps', -1), ('alive', False)):
+            old = self.store_dict[key]
+            new = np.full((capacity,) + old.shape[1:], fill, dtype=old.dtype)
+            new[:len(old)] = old
+            self.store_dict[key] = new
+
+        self.store_dict['names'].extend([None] * (capacity - len(self.store_dict['names'])))
+
+    def stat_rows(self, stats):
+        # Turn battler_stats, or lists in Stat_Sheet order, into rows of the stat table; max_health starts at health when it is not given
+        if not isinstance(stats, np.ndarray):
+            stats = [i.stat_array if isinstance(i, battler_stats) else i for i in stats]
+        stats = np.array(stats, dtype=float).reshape(len(stats), -1)
+        if stats.shape[1] == len(Stat_Sheet):
+            stats = np.column_stack((stats, stats[:, Stat_Columns.health]))
+
+        return stats
+
+    def add(self, name, location, x, y, stats):
+        return self.view(self.add_many([name], location, [[y, x]], [stats])[0])
+
+    def add_many(self, names, location, cords, stats):
+        # Add a batch of entities on one map; cords are [y, x] pairs. Returns their rows.
+        count = len(names)
+        free = self.store_dict['free']
+        reused = [free.pop() for i in range(min(count, len(free)))]
+        self.grow(self.store_dict['size'] + count - len(reused))
+
+        rows = np.concatenate((np.array(reused, dtype=np.intp), np.arange(self.store_dict['size'], self.store_dict['size'] + count - len(reused))))
+        self.store_dict['size'] += count - len(reused)
+
+        self.stats[rows] = self.stat_rows(stats)
+        self.cords[rows] = np.asarray(cords, dtype=np.intp).reshape(count, 2)
+        self.maps[rows] = self.map_code(location)
+        self.alive[rows] = True
+        for row, name in zip(rows.tolist(), names):
+            self.store_dict['names'][row] = name
+
+        return rows
+
+    def remove(self, rows):
+        rows = np.atleast_1d(np.asarray(rows, dtype=np.intp))
+        rows = rows[self.alive[rows]]
+        self.alive[rows] = False
+        self.maps[rows] = -1
+        for row in rows.tolist():
+            self.store_dict['names'][row] = None
+        self.store_dict['free'].extend(rows.tolist())
+
+        # Their buffs go with them
+        keep = ~np.isin(self.store_dict['buff_rows'], rows)
+        for key in ('buff_rows', 'buff_changes', 'buff_ticks'):
+            self.store_dict[key] = self.store_dict[key][keep]
+
+    def view(self, row):
+        return entity_view(self, int(row))
+
+    def views(self, rows=None):
+        return [entity_view(self, row) for row in (self.rows if rows is None else np.asarray(rows)).tolist()]
+
+    def on_map(self, mapid):
+        return np.flatnonzero(self.alive & (self.maps == self.store_dict['map_codes'].get(mapid, -2)))
+
+    def within(self, mapid, cord, radius):
+        # Rows whose straight-line distance from cord is at most radius, the same as spatial_index.within()
+        rows = self.on_map(mapid)
+        offset = self.cords[rows] - np.array([cord[Locate_Entity.y_cord], cord[Locate_Entity.x_cord]])
+        return rows[(offset ** 2).sum(axis=1) <= radius ** 2]
+
+    def defeated(self, rows=None):
+        # Rows that have run out of health
+        rows = self.rows if rows is None else np.asarray(rows, dtype=np.intp)
+        return rows[self.stats[rows, Stat_Columns.health] <= 0]
+
+    def damage(self, rows, dmg):
+        # Deal dmg to every row, reduced by armor the way battle_manager.use_attack() reduces it. Returns the damage each row took.
+        rows = np.asarray(rows, dtype=np.intp)
+        taken = np.maximum(np.round(dmg - self.stats[rows, Stat_Columns.armor] ** (4 / 5)), 1)
+        self.stats[rows, Stat_Columns.health] -= taken
+
+        return taken
+
+    def damage_radius(self, mapid, cord, radius, dmg):
+        # Damage every entity within radius of cord. Returns the rows that were hit.
+        rows = self.within(mapid, cord, radius)
+        self.damage(rows, dmg)
+
+        return rows
+
+    def regen(self, amount, rows=None):
+        # Heal rows (everyone by default) without going over their max health
+        rows = self.rows if rows is None else np.asarray(rows, dtype=np.intp)
+        health = self.stats[rows, Stat_Columns.health] + amount
+        self.stats[rows, Stat_Columns.health] = np.minimum(health, self.stats[rows, Stat_Columns.max_health])
+
+    def apply_buff(self, rows, changes, duration):
+        # Change rows' stats by a Stat_Sheet list, like a stat_item, and undo it after 'duration' calls to tick_buffs()
+        rows = np.atleast_1d(np.asarray(rows, dtype=np.intp))
+        changes = np.broadcast_to(np.asarray(changes, dtype=float), (len(rows), len(Stat_Sheet)))
+        np.add.at(self.stats[:, :len(Stat_Sheet)], rows, changes)
+
+        if duration > 0:
+            self.store_dict['buff_rows'] = np.concatenate((self.store_dict['buff_rows'], rows))
+            self.store_dict['buff_changes'] = np.concatenate((self.store_dict['buff_changes'], changes))
+            self.store_dict['buff_ticks'] = np.concatenate((self.store_dict['buff_ticks'], np.full(len(rows), duration, dtype=np.intp)))
+
+    def tick_buffs(self):
+        # Count every buff down by one, undoing those that run out. Returns the rows whose buffs ran out.
+        self.store_dict['buff_ticks'] -= 1
+        expired = self.store_dict['buff_ticks'] <= 0
+
+        rows = self.store_dict['buff_rows'][expired]
+        np.subtract.at(self.stats[:, :len(Stat_Sheet)], rows, self.store_dict['buff_changes'][expired])
+
+        for key in ('buff_rows', 'buff_changes', 'buff_ticks'):
+            self.store_dict[key] = self.store_dict[key][~expired]
+
+        return np.unique(rows)
+
+
+class entity_view:
+    # One row of an entity_store, read and written through the same properties as an entity
+    __slots__ = ('store', 'row')
+
+    def __init__(self, store, row):
+        self.store = store
+        self.row = row
+
+    @property
+    def name(self):
+        return self.store.store_dict['names'][self.row]
+
+    @name.setter
+    def name(self, value):
+        self.store.store_dict['names'][self.row] = value
+
+    @property
+    def location(self):
+        return [self.store.map_at(self.store.maps[self.row]), self.store.cords[self.row].tolist()]
+
+    def set_loc(self, cord, location=None):
+        if location is not None:
+            self.store.maps[self.row] = self.store.map_code(location)
+
+        self.store.cords[self.row] = (cord[Locate_Entity.y_cord], cord[Locate_Entity.x_cord])
+
+    @property
+    def stats(self):
+        return battler_stats.view(self.store.stats[self.row])
 
 #
 # Battle Backend #
@@ -664,23 +2652,202 @@ class ammo_attack(attack):
 #
 
 
+class item_stacks:
+    # An inventory kept as item -> quantity stacks, in the order each item was first added.
+    # It reads like a list holding one entry per unit, but adding, removing and counting cost the same for one arrow or ten thousand.
+    # The stacks are also indexed by item class and Item_Types, and heal items are kept sorted by heal amount, for the battle AI.
+    __slots__ = ('stack_dict', 'total', 'kind_index', 'unit_index', 'heal_list', 'heal_keys', 'added')
+
+    def __init__(self, items=()):
+        self.clear()
+        self.extend(items)
+
+    def index_keys(self, itm):
+        # Every class the item is an instance of, and its Item_Types value
+        keys = [cls for cls in type(itm).__mro__ if cls is not object]
+        if isinstance(getattr(itm, 'type', None), Item_Types):
+            keys.append(itm.type)
+
+        return keys
+
+    def add(self, itm, amnt=1):
+        if amnt <= 0:
+            return
+
+        held = self.stack_dict.get(itm, 0)
+        self.stack_dict[itm] = held + amnt
+        self.total += amnt
+
+        for key in self.index_keys(itm):
+            if held == 0:
+                self.kind_index.setdefault(key, {})[itm] = None
+            self.unit_index[key] = self.unit_index.get(key, 0) + amnt
+
+        if held == 0 and isinstance(itm, heal_item):
+            from bisect import insort
+
+            # The running count breaks ties, so items themselves are never compared
+            self.heal_keys[itm] = (itm.heal_amnt, self.added)
+            self.added += 1
+            insort(self.heal_list, self.heal_keys[itm] + (itm,))
+
+    def take(self, itm, amnt=1):
+        # Remove up to amnt of an item; returns how many were actually removed
+        held = self.stack_dict.get(itm, 0)
+        taken = max(min(held, amnt), 0)
+        if taken == 0:
+            return 0
+
+        if taken == held:
+            del self.stack_dict[itm]
+        else:
+            self.stack_dict[itm] = held - taken
+        self.total -= taken
+
+        for key in self.index_keys(itm):
+            self.unit_index[key] -= taken
+            if taken == held:
+                del self.kind_index[key][itm]
+
+        if taken == held and itm in self.heal_keys:
+            from bisect import bisect_left
+
+            del self.heal_list[bisect_left(self.heal_list, self.heal_keys.pop(itm))]
+
+        return taken
+
+    def units(self, key):
+        # How many units are instances of a class, or of an Item_Types value
+        return self.unit_index.get(key, 0)
+
+    def stacks_of(self, key):
+        # (item, quantity) pairs for the items that are instances of a class, or of an Item_Types value
+        return [(itm, self.stack_dict[itm]) for itm in self.kind_index.get(key, ())]
+
+    def nth_of(self, key, index):
+        # The index-th unit among those of a class, counting through each stack in turn; picking a random index weighs items by quantity
+        for itm in self.kind_index.get(key, ()):
+            if index < self.stack_dict[itm]:
+                return itm
+            index -= self.stack_dict[itm]
+
+        raise IndexError('item_stacks index out of range')
+
+    def heals(self):
+        # Heal items from weakest to strongest
+        return [entry[-1] for entry in self.heal_list]
+
+    def best_heal(self, limit=None):
+        # The strongest heal item that heals at most limit (or at all when limit is None), or None if there is none
+        from bisect import bisect_right
+
+        if limit is None:
+            found = len(self.heal_list)
+        else:
+            found = bisect_right(self.heal_list, (limit, float('inf')))
+
+        return self.heal_list[found - 1][-1] if found > 0 else None
+
+    def append(self, itm):
+        self.add(itm)
+
+    def extend(self, items):
+        if isinstance(items, item_stacks):
+            for itm, amnt in items.stacks():
+                self.add(itm, amnt)
+        else:
+            for itm in items:
+                self.add(itm)
+
+    def remove(self, itm):
+        if self.take(itm) == 0:
+            raise ValueError('item_stacks.remove(x): x not in inventory')
+
+    def count(self, itm):
+        return self.stack_dict.get(itm, 0)
+
+    def stacks(self):
+        # (item, quantity) pairs, one per kind of item
+        return list(self.stack_dict.items())
+
+    def kinds(self):
+        return list(self.stack_dict)
+
+    def copy(self):
+        return item_stacks(self)
+
+    def replace(self, items):
+        # Make these stacks the same as another inventory, e.g. to restore a saved copy
+        self.clear()
+        self.extend(items)
+
+    def clear(self):
+        self.stack_dict = {}
+        self.total = 0
+        # Class or Item_Types -> {item: None} for the stacks of that kind, in the order they were added, and their total units
+        self.kind_index = {}
+        self.unit_index = {}
+        # (heal amount, order added, item) for every heal item, sorted
+        self.heal_list = []
+        self.heal_keys = {}
+        self.added = 0
+
+    def __len__(self):
+        return self.total
+
+    def __contains__(self, itm):
+        return itm in self.stack_dict
+
+    def __iter__(self):
+        # One entry per unit, like the list this replaced; loop over stacks() instead where possible
+        for itm, amnt in self.stack_dict.items():
+            for i in range(amnt):
+                yield itm
+
+    def __getitem__(self, index):
+        # Unit-by-unit indexing, which has to walk the stacks; prefer stacks()
+        if isinstance(index, slice):
+            return list(self)[index]
+
+        if index < 0:
+            index += self.total
+        if not 0 <= index < self.total:
+            raise IndexError('item_stacks index out of range')
+
+        for itm, amnt in self.stack_dict.items():
+            if index < amnt:
+                return itm
+            index -= amnt
+
+    def __eq__(self, other):
+        if isinstance(other, item_stacks):
+            return self.stack_dict == other.stack_dict
+
+        return list(self) == other
+
+    def __repr__(self):
+        return f"item_stacks({', '.join(f'{itm.name} x{amnt}' for itm, amnt in self.stack_dict.items())})"
+
+
 class item_collection(ABC):
-    def __init__(self, coin, items=list()):
-        self.collect_dict = {'collection': items}
+    def __init__(self, coin, items=()):
+        self.collect_dict = {'collection': item_stacks(items)}
         self.collect_dict['currency'] = coin
         self.collect_dict['Error_No_Exist'] = "That item doesn't exist in this inventory."
 
     def add_item(self, itm, amnt=Enumerators.items_to_modify):
-        for i in range(amnt):
-            self.items.append(itm)
+        self.items.add(itm, amnt)
+
+    def add_items(self, basket):
+        # Add many items at once from {item: amount}
+        for itm, amnt in basket.items():
+            self.items.add(itm, amnt)
 
     def rem_item(self, itm, amnt=Enumerators.items_to_modify):
-        for i in range(amnt):
-            try:
-                self.items.remove(itm)
-            except ValueError:
-                print(f"There is/are no more {itm.name} to use, sell, or buy.")
-                return False
+        # Removes as many as there are, even when there are fewer than amnt
+        if self.items.take(itm, amnt) < amnt:
+            print(f"There is/are no more {itm.name} to use, sell, or buy.")
+            return False
 
         return True
 
@@ -699,23 +2866,54 @@ class item_collection(ABC):
 
 
 class vendor_collection(item_collection):
-    def __init__(self, coin, items=list()):
+    def __init__(self, coin, items=()):
         super().__init__(coin, items)
 
     def swap_item(self, swapee, itm, count=Enumerators.items_to_modify):
-        if itm in self.items:
-            for i in range(count):
-                if (swapee.collection.coin >= (itm.value * count)) or swapee.collection.coin == Enumerators.infinite_coin:
-                    # Swap items
-                    swapee.collection.add_item(itm)
-                    self.rem_item(itm)
-                    # Swap coin
-                    swapee.collection.coin = (itm.value * -1)
-                    self.coin = itm.value
-                else:
-                    print(f"{swapee.name} ran out of money.")
-        else:
-            self.collect_dict['Error_No_Exist']
+        return self.trade(swapee, {itm: count})
+
+    def basket_price(self, basket):
+        return sum(itm.value * count for itm, count in basket.items())
+
+    def trade(self, swapee, basket):
+        # Sell swapee every item in a basket of {item: amount} (or (item, amount) pairs) as one transaction.
+        # Stock and funds are checked for the whole basket first, so either everything changes hands or nothing does.
+        merged = {}
+        for itm, count in (basket.items() if isinstance(basket, dict) else basket):
+            merged[itm] = merged.get(itm, 0) + count
+
+        if any(count < 0 for count in merged.values()):
+            raise ValueError('An amount in a basket cannot be negative.')
+
+        # Buying none of something is allowed and does nothing, like swap_item(count=0) always has
+        basket = {itm: count for itm, count in merged.items() if count > 0}
+        if basket == {}:
+            return True
+
+        for itm, count in basket.items():
+            if itm not in self.items:
+                print(self.collect_dict['Error_No_Exist'])
+                return False
+            elif self.items.count(itm) < count:
+                print(f"There is/are only {self.items.count(itm)} {itm.name} to sell.")
+                return False
+
+        price = self.basket_price(basket)
+        if (swapee.collection.coin < price) and swapee.collection.coin != Enumerators.infinite_coin:
+            print(f"{swapee.name} ran out of money.")
+            return False
+
+        # Swap items
+        for itm, count in basket.items():
+            self.items.take(itm, count)
+        swapee.collection.add_items(basket)
+
+        # Swap coin
+        swapee.collection.coin = price * -1
+        self.coin = price
+
+        pub_trade.send(sender=self, buyer=swapee, basket=basket, price=price)
+        return True
 
 
 class battler_collection(item_collection):
@@ -723,9 +2921,12 @@ class battler_collection(item_collection):
         super().__init__(coin, items)
         self.collect_dict['on_entity'] = equipped
         self.collect_dict['Errors'] = "Couldn't equip item."
+        # Running total of every equipped item's Stat_Sheet changes, and how much of it the battler's stats have been sent so far
+        self.collect_dict['equip_stats'] = np.zeros(len(Stat_Sheet), dtype=np.int64)
+        self.collect_dict['applied_stats'] = np.zeros(len(Stat_Sheet), dtype=np.int64)
 
-        if len(self.equipped) > 0:
-            self.update_stats()
+        for itm in self.equipped:
+            self.collect_dict['equip_stats'] = self.collect_dict['equip_stats'] + np.asarray(itm.stat_changes)
 
     @property
     def equipped(self):
@@ -733,23 +2934,28 @@ class battler_collection(item_collection):
 
     @property
     def item_stats(self):
-        temp = [0, 0, 0, 0, 0]
-        for i in range(len(self.equipped)):
-            temp = [temp[j] + self.equipped[i].stat_changes[j] for j in range(len(temp))]
+        return self.collect_dict['equip_stats'].tolist()
 
-        return temp
+    def update_stats(self, full=False):
+        # Send the battler only what changed since the last update, since it adds whatever it is sent onto its stats
+        # full sends the whole total instead, for a battler taking over the collection that has had none of it applied yet
+        if full is True:
+            self.collect_dict['applied_stats'] = np.zeros(len(Stat_Sheet), dtype=np.int64)
 
-    def update_stats(self):
-        pub_stat_change.send(sender=self, changes=self.item_stats)
+        changes = self.collect_dict['equip_stats'] - self.collect_dict['applied_stats']
+        if changes.any():
+            self.collect_dict['applied_stats'] = self.collect_dict['equip_stats'].copy()
+            pub_stat_change.send(sender=self, changes=changes.tolist())
 
     def equip(self, itm):
         try:
             if itm in self.items:
-                for i in range(len(self.equipped)):
-                    if itm.__class__ == self.equipped[i].__class__:
-                        del self.equipped[i]
+                # Only one item of each kind can be worn at a time
+                for worn in [worn for worn in self.equipped if worn.__class__ == itm.__class__]:
+                    self.take_off(worn)
 
                 self.equipped.append(itm)
+                self.collect_dict['equip_stats'] = self.collect_dict['equip_stats'] + np.asarray(itm.stat_changes)
                 self.update_stats()
             else:
                 print(self.collect_dict['Error_No_Exist'])
@@ -757,6 +2963,17 @@ class battler_collection(item_collection):
         except AttributeError:
             print(self.collect_dict['Errors'])
 
+    def unequip(self, itm):
+        if itm in self.equipped:
+            self.take_off(itm)
+            self.update_stats()
+        else:
+            print(self.collect_dict['Error_No_Exist'])
+
+    def take_off(self, itm):
+        self.equipped.remove(itm)
+        self.collect_dict['equip_stats'] = self.collect_dict['equip_stats'] - np.asarray(itm.stat_changes)
+
     def move_item(self, itm, movee):
         if self.rem_item(itm) is True:
             movee.collection.add_item(itm)
@@ -767,11 +2984,16 @@ class player_collection(battler_collection, vendor_collection):
         super().__init__(coin, items, equipped)
 
     def add_item(self, itm, amnt=Enumerators.items_to_modify):
-        for i in range(amnt):
-            self.items.append(itm)
+        self.items.add(itm, amnt)
 
         pub_item_obtained.send(sender=self, itms=self.items)
 
+    def add_items(self, basket):
+        super().add_items(basket)
+
+        # One event for the whole basket
+        pub_item_obtained.send(sender=self, itms=self.items)
+
 #
 # Quests #
 #
@@ -826,7 +3048,12 @@ class ChooseAgain(Exception):
 class battle_manager(ABC):
     def __init__(self):
         self.e = 2.7182
-        self.battle_dict = {'turn': 0, 'turn_counter': 1, 'power_counter': 1, 'first_turn': None, 'continue_prompt': '\n(Press enter to continue.)'}
+        self.battle_dict = {'continue_prompt': '\n(Press enter to continue.)'}
+        self.reset_battle()
+
+    def reset_battle(self):
+        # Return the turn counters, status effects and AI memory to their starting values
+        self.battle_dict.update({'turn': 0, 'turn_counter': 1, 'power_counter': 1, 'first_turn': None})
 
         self.battle_dict['effect_dict'] = {'reverse_effect_player': [], 'reverse_effect_enemy': []}
 
@@ -840,6 +3067,10 @@ class battle_manager(ABC):
         from random import randint
         return randint(lo, hi)
 
+    def narrate(self, phrase):
+        # Every line of battle text goes through here so that headless battles can silence it
+        write(phrase)
+
     def calc_agility(self, agi):
         try:
             return round((150) / (1 + (self.e ** ((-1 / 30) * agi))) - 75)
@@ -926,11 +3157,10 @@ class battle_manager(ABC):
             temp_hit_check = self.randnum(100)
 
         if (self.randnum(100) <= attk.hit_rate) and (temp_hit_check >= self.calc_agility(target.stats.agility)):
-                # Attack landed; calculate damage
-                try:
-                    temp_damage = round(((user.stats.stren * attk.dmg ** (user.stats.stren ** .05)) ** .5) + self.randnum(round((user.stats.stren / 2) ** (1/2))))
-                except TypeError:
-                    temp_damage = round(((1 * attk.dmg ** (1 ** .05)) ** .5) + self.randnum(round((1 / 2) ** (1/2))))
+                # Attack landed; calculate damage. Strength below 1, including a strength that was never set (stored as 0), hits like 1
+                temp_stren = max(user.stats.stren, 1)
+                temp_damage = round(((temp_stren * attk.dmg ** (temp_stren ** .05)) ** .5) + self.randnum(max(round((temp_stren / 2) ** (1/2)), 1)))
+                del temp_stren
                 try:
                     temp_damage_recieved = round(temp_damage - target.stats.armor ** (4 / 5))
                 except TypeError:
@@ -943,10 +3173,10 @@ class battle_manager(ABC):
                     # Indicate critical hit
                     temp_damage_recieved *= 3/2
                     temp_damage_recieved = round(temp_damage_recieved)
-                    write((f"{user.name} used {attk.name}.", "It was a critical hit!", f"{user.name} dealt {temp_damage_recieved} to {target.name}."))
+                    self.narrate((f"{user.name} used {attk.name}.", "It was a critical hit!", f"{user.name} dealt {temp_damage_recieved} to {target.name}."))
                 else:
                     # No crit
-                    write(f"{user.name} used {attk.name}, and dealt {temp_damage_recieved} damage to {target.name}.")
+                    self.narrate(f"{user.name} used {attk.name}, and dealt {temp_damage_recieved} damage to {target.name}.")
 
                 target.stats.health -= temp_damage_recieved
 
@@ -967,7 +3197,7 @@ class battle_manager(ABC):
 
         else:
             # Attack missed, end turn
-            write(f"{user.name} tried to use {attk.name}, but they missed.")
+            self.narrate(f"{user.name} tried to use {attk.name}, but they missed.")
             return False
 
     def stat_change_writeout(self):
@@ -1020,11 +3250,11 @@ class battle_manager(ABC):
                     else:
                         thing.stats.health += itm.heal_amnt
 
-                    write(f"{thing.name} used a {itm.name}, and regained {itm.heal_amnt} health.")
+                    self.narrate(f"{thing.name} used a {itm.name}, and regained {itm.heal_amnt} health.")
                 elif isinstance(itm, stat_item):
                     self.calc_effect_queue(thing, itm)
                     self.use_item_stat(thing, itm.stat_changes)
-                    write(f"{thing.name} used a {itm.name}.")
+                    self.narrate(f"{thing.name} used a {itm.name}.")
 
                 thing.collection.rem_item(itm)
 
@@ -1032,12 +3262,12 @@ class battle_manager(ABC):
                 print(f"This item does not exist in {thing.name}'s inventory.")
 
     def chance_item(self, enemy):
-        enemy_has_stat_items = [isinstance(i, stat_item) for i in enemy.collection.items]
-        enemy_has_heal_items = [isinstance(i, heal_item) for i in enemy.collection.items]
+        enemy_has_stat_items = enemy.collection.items.units(stat_item) > 0
+        enemy_has_heal_items = enemy.collection.items.units(heal_item) > 0
 
-        if (True in enemy_has_stat_items) and (self.battle_dict['ai']['used_item'] > 0):
+        if enemy_has_stat_items and (self.battle_dict['ai']['used_item'] > 0):
             return round((100) / (1 + (self.e ** ((-1 / 2) * self.battle_dict['ai']['used_item']))) - 50)
-        elif (True in enemy_has_heal_items) and (self.battle_dict['ai']['used_item'] > 0):
+        elif enemy_has_heal_items and (self.battle_dict['ai']['used_item'] > 0):
             return self.chance_heal(enemy)
         else:
             return 0
@@ -1046,9 +3276,9 @@ class battle_manager(ABC):
         return ((thing.stats.health / thing.stats.max_health) * 100)
 
     def chance_heal(self, enemy):
-        enemy_has_heal_items = [isinstance(i, heal_item) for i in enemy.collection.items]
+        enemy_has_heal_items = enemy.collection.items.units(heal_item) > 0
 
-        if (True in enemy_has_heal_items) and (self.percent_health(enemy) <= 80):
+        if enemy_has_heal_items and (self.percent_health(enemy) <= 80):
             return round(-25719423 + (89.67716 - -25719430)/(1 + ((self.percent_health(enemy) / 1720762) ** 1.286616)))
         else:
             return 0
@@ -1140,12 +3370,11 @@ class battle_manager(ABC):
         # Writeout valid items
         valid_items = []
         temp_index = 1
-        for i in range(len(plyr.collection.items)):
-            if isinstance(plyr.collection.items[i], heal_item) or isinstance(plyr.collection.items[i], stat_item):
-                print(f"{temp_index}. {plyr.collection.items[i].name}")
-                valid_items.append((temp_index, plyr.collection.items[i]))
+        for itm, amnt in plyr.collection.items.stacks_of(heal_item) + plyr.collection.items.stacks_of(stat_item):
+            print(f"{temp_index}. {itm.name} (x{amnt})")
+            valid_items.append((temp_index, itm))
 
-                temp_index += 1
+            temp_index += 1
 
         if valid_items == []:
             print('\nYou have no items to use.')
@@ -1227,39 +3456,19 @@ class battle_manager(ABC):
                     print('Invalid input.')
 
     def enemy_use_heal_item(self, enemy):
-        # Use healing item
-        heals_ordered_best = []
-
-        # Generate list of healing items that don't overheal the enemy
-        for heal in enemy.collection.items:
-            if isinstance(heal, heal_item) and (enemy.stats.health + heal.heal_amnt <= enemy.stats.max_health):
-                heals_ordered_best.append((heal.heal_amnt, heal))
-
-        if heals_ordered_best != []:
-            # Order them by what item will heal them the most
-            heals_ordered_best.sort(reverse=True)
-
-            # Use the item
-            self.use_item(enemy, heals_ordered_best[0][1])
-
-            # Delete unneeded var
-            del heals_ordered_best
+        # Use the healing item that heals the most without overhealing the enemy
+        best_heal = enemy.collection.items.best_heal(enemy.stats.max_health - enemy.stats.health)
+        if best_heal is not None:
+            self.use_item(enemy, best_heal)
             return True
 
-        # Create list of healing items and sort them based on how effective they are
-        temp_heal_list = []
-        for heal in enemy.collection.items:
-            if isinstance(heal, heal_item):
-                temp_heal_list.append((heal.heal_amnt, heal))
-        temp_heal_list.sort()
+        # Every healing item would overheal, so use the weakest one
+        weakest_heal = enemy.collection.items.heals()[0]
 
         # Use item and display its use
-        write(f"{enemy.name} used a {temp_heal_list[0][1].name} and regained {enemy.stats.max_health - enemy.stats.health} health.")
-        self.use_item(enemy, temp_heal_list[0][1])
+        self.narrate(f"{enemy.name} used a {weakest_heal.name} and regained {enemy.stats.max_health - enemy.stats.health} health.")
+        self.use_item(enemy, weakest_heal)
 
-        # Finish up
-        del temp_heal_list
-        del heals_ordered_best
         return True
 
     def enemy_use_item(self, enemy):
@@ -1267,27 +3476,20 @@ class battle_manager(ABC):
         # Generate random number
         enemy_choice = self.randnum(100)
         # Check if there are valid items or not
-        valid_stat_items = (isinstance(itm, stat_item) for itm in enemy.collection.items)
-        if (enemy_choice <= self.chance_heal(enemy)) or all(check is False for check in valid_stat_items):
+        valid_stat_items = enemy.collection.items.units(stat_item)
+        if (enemy_choice <= self.chance_heal(enemy)) or valid_stat_items == 0:
             self.enemy_use_heal_item(enemy)
         else:
             # Use buff item
 
-            # Generate list of places in inventory where buff items exist
-            temp_stat_items = []
-            for i in range(len(enemy.collection.items)):
-                if isinstance(enemy.collection.items[i], stat_item):
-                    temp_stat_items.append(i)
-
-            # Randomly select buff from list of places in inventory
-            enemy_choice = self.randnum(len(temp_stat_items) - 1, 0)
-            buff_choice = enemy.collection.items[temp_stat_items[enemy_choice]]
+            # Randomly select a buff, weighted by how many of each the enemy has
+            enemy_choice = self.randnum(valid_stat_items - 1, 0)
+            buff_choice = enemy.collection.items.nth_of(stat_item, enemy_choice)
 
             # Tell player and use buff
-            write(f"{enemy.name} used a {buff_choice.name}.")
+            self.narrate(f"{enemy.name} used a {buff_choice.name}.")
             self.use_item(enemy, buff_choice)
 
-            del temp_stat_items
             return True
 
     def enemy_determine_attack(self, enemy):
@@ -1295,10 +3497,7 @@ class battle_manager(ABC):
             random_attack = enemy.attacks[self.randnum(len(enemy.attacks)) - 1]
 
             if isinstance(random_attack, ammo_attack):
-                req_items = 0
-                for itm in enemy.collection.items:
-                    if itm is random_attack.ammo_type:
-                        req_items += 1
+                req_items = enemy.collection.items.count(random_attack.ammo_type)
 
                 if req_items >= random_attack.ammo_cost:
                     return random_attack
@@ -1320,6 +3519,7 @@ class battle_manager(ABC):
         """
 
     def battle(self, plyr, enemy, spec_effect=None, music=None):
+        self.reset_battle()
         self.determine_first_turn(plyr, enemy)
 
         if isinstance(music, str):
@@ -1518,3 +3718,4 @@ class object_tracker:
 
 tracker = object_tracker()
 loc_man = location_manager()
+entity_index = spatial_index()
@@ -0,0 +1,146 @@
+# Gilbo_Generation builds array_map layouts procedurally.
+# Every generator is seeded, so the same seed always builds the same world, on any machine.
+from sys import path
+path.append('./deps/')
+
+import numpy as np
+
+from Gilbo import Tiles
+
+
+class map_generator:
+    def __init__(self, seed=0):
+        self.gen_dict = {'seed': seed}
+
+    @property
+    def seed(self):
+        return self.gen_dict['seed']
+
+    def rng(self, *stream):
+        # Each stage draws from its own stream, so changing one stage never shifts the numbers another one gets
+        return np.random.default_rng([self.seed, *stream])
+
+    def fill(self, mapid, layout):
+        mapid.layout = layout
+        return mapid
+
+    #
+    # Noise #
+    #
+
+    def smooth_axis(self, coarse, size, cell, axis):
+        # Stretch the coarse grid along one axis, blending neighbouring points with a smoothstep curve
+        position = np.arange(size, dtype=np.float32) / np.float32(cell)
+        index = position.astype(np.intp)
+        weight = position - np.floor(position)
+        weight = weight * weight * (3 - 2 * weight)
+
+        if axis == 0:
+            low = coarse[index]
+            return low + (coarse[index + 1] - low) * weight[:, None]
+
+        low = coarse[:, index]
+        return low + (coarse[:, index + 1] - low) * weight[None, :]
+
+    def noise(self, rows, clmns, scale=64, octaves=4, persistence=.5, stream=0):
+        # Layered value noise in [0, 1), where scale is the size in tiles of the largest features
+        rng = self.rng(0, stream)
+        total = np.zeros((rows, clmns), dtype=np.float32)
+        amplitude = np.float32(1)
+        weight = np.float32(0)
+
+        for octave in range(octaves):
+            cell = max(scale / 2 ** octave, 1)
+            coarse = rng.random((int(rows / cell) + 2, int(clmns / cell) + 2), dtype=np.float32)
+            # Stretch the short side first, so the full-size pass only has to copy whole rows
+            total += self.smooth_axis(self.smooth_axis(coarse, clmns, cell, 1), rows, cell, 0) * amplitude
+            weight += amplitude
+            amplitude *= np.float32(persistence)
+
+        return total / weight
+
+    #
+    # Generators #
+    #
+
+    def terrain(self, rows, clmns, scale=64, octaves=4, water=.38, shore=.43, mountain=.68, peak=.78):
+        # Overworld terrain: water, dirt shores, grassland, mountains and icy peaks by height
+        height = self.noise(rows, clmns, scale, octaves, stream=1)
+
+        layout = np.full((rows, clmns), Tiles.Grass, dtype=np.uint8)
+        layout[height < shore] = Tiles.Dirt
+        layout[height < water] = Tiles.Water
+        layout[height >= mountain] = Tiles.Mountain
+        layout[height >= peak] = Tiles.Ice
+
+        return layout
+
+    def caves(self, rows, clmns, fill=.45, steps=4, floor=Tiles.Dirt, wall=Tiles.Wall):
+        # Cellular automata caves: start from random rock, then let each tile follow the majority of its neighbourhood
+        rock = self.rng(2).random((rows, clmns), dtype=np.float32) < fill
+
+        for step in range(steps):
+            padded = np.pad(rock, 1, constant_values=True).astype(np.uint8)
+            count = np.zeros((rows, clmns), dtype=np.uint8)
+            for dy in range(3):
+                for dx in range(3):
+                    count += padded[dy:dy + rows, dx:dx + clmns]
+            rock = count >= 5
+
+        # Seal the edges
+        rock[[0, -1], :] = True
+        rock[:, [0, -1]] = True
+
+        return np.where(rock, np.uint8(wall), np.uint8(floor))
+
+    def rooms(self, rows, clmns, min_size=8, max_size=32, floor=Tiles.Dirt, wall=Tiles.Wall, door=Tiles.Building):
+        # Binary space partitioning: split the area until the pieces are small, put a room in each, then join sibling rooms
+        rng = self.rng(3)
+        layout = np.full((rows, clmns), wall, dtype=np.uint8)
+
+        def carve_path(start, end):
+            # L-shaped corridor between two points
+            (y0, x0), (y1, x1) = start, end
+            layout[min(y0, y1):max(y0, y1) + 1, x0] = floor
+            layout[y1, min(x0, x1):max(x0, x1) + 1] = floor
+
+        def split(top, left, bottom, right):
+            height, width = bottom - top, right - left
+
+            # Split along the longer side while both halves can still hold a room
+            if max(height, width) > max_size or (max(height, width) >= 2 * min_size and rng.random() < .5):
+                vertical = width > height if width != height else rng.random() < .5
+                size = width if vertical else height
+                if size >= 2 * min_size:
+                    cut = int(rng.integers(min_size, size - min_size + 1))
+                    if vertical:
+                        first = split(top, left, bottom, left + cut)
+                        second = split(top, left + cut, bottom, right)
+                    else:
+                        first = split(top, left, top + cut, right)
+                        second = split(top + cut, left, bottom, right)
+
+                    carve_path(first, second)
+                    return first if rng.random() < .5 else second
+
+            # Leaf: carve a room with a wall border inside this piece
+            room_height = int(rng.integers(min(3, height - 2), height - 1)) if height > 4 else max(height - 2, 1)
+            room_width = int(rng.integers(min(3, width - 2), width - 1)) if width > 4 else max(width - 2, 1)
+            room_top = top + 1 + int(rng.integers(0, max(height - room_height - 1, 1)))
+            room_left = left + 1 + int(rng.integers(0, max(width - room_width - 1, 1)))
+            layout[room_top:room_top + room_height, room_left:room_left + room_width] = floor
+
+            centre = (min(room_top + room_height // 2, rows - 2), min(room_left + room_width // 2, clmns - 2))
+            if door is not None:
+                layout[min(room_top + room_height, rows - 1), centre[1]] = door
+            return centre
+
+        split(0, 0, rows, clmns)
+        return layout
+
+    def scatter(self, layout, til, chance, on=Tiles.Grass, stream=0):
+        # Sprinkle a tile (lava, pits, caves...) over a fraction of the tiles of another type
+        mask = (layout == on) & (self.rng(4, stream).random(layout.shape, dtype=np.float32) < chance)
+        layout[mask] = til
+
+        return layout
@@ -0,0 +1,693 @@
+# Gilbo_Simulation runs Gilbo's battle logic without any terminal I/O.
+# It is meant for balance testing, and shares every rule with battle_manager.battle().
+from sys import path
+path.append('./deps/')
+
+from abc import ABC, abstractmethod
+from enum import IntEnum
+from random import Random
+
+import numpy as np
+
+from Gilbo import battle_manager, attack, ammo_attack, item_stacks, Enumerators, Turn, TurnComplete
+
+
+#
+# Results #
+#
+
+
+class Battle_Outcomes(IntEnum):
+    player_win = 0
+    player_lose = 1
+    draw = 2
+
+
+class battle_result:
+    def __init__(self, outcome, turns, plyr_hp, enemy_hp, plyr_items, enemy_items):
+        self.result_dict = {'outcome': outcome}
+        self.result_dict['turns'] = turns
+        self.result_dict['player_health'] = plyr_hp
+        self.result_dict['enemy_health'] = enemy_hp
+        self.result_dict['player_items'] = plyr_items
+        self.result_dict['enemy_items'] = enemy_items
+
+    @property
+    def outcome(self):
+        return self.result_dict['outcome']
+
+    @property
+    def turns(self):
+        return self.result_dict['turns']
+
+    @property
+    def plyr_hp(self):
+        return self.result_dict['player_health']
+
+    @property
+    def enemy_hp(self):
+        return self.result_dict['enemy_health']
+
+    @property
+    def plyr_items(self):
+        return self.result_dict['player_items']
+
+    @property
+    def enemy_items(self):
+        return self.result_dict['enemy_items']
+
+
+def summarize(results):
+    summary = {'fights': len(results), 'win_rate': 0, 'lose_rate': 0, 'draw_rate': 0, 'mean_turns': 0}
+    summary['player_items'] = {}
+    summary['enemy_items'] = {}
+
+    if summary['fights'] == 0:
+        return summary
+
+    outcomes = [0, 0, 0]
+    for result in results:
+        outcomes[result.outcome] += 1
+        summary['mean_turns'] += result.turns
+
+        for name, used in result.plyr_items.items():
+            summary['player_items'][name] = summary['player_items'].get(name, 0) + used
+        for name, used in result.enemy_items.items():
+            summary['enemy_items'][name] = summary['enemy_items'].get(name, 0) + used
+
+    summary['win_rate'] = outcomes[Battle_Outcomes.player_win] / summary['fights']
+    summary['lose_rate'] = outcomes[Battle_Outcomes.player_lose] / summary['fights']
+    summary['draw_rate'] = outcomes[Battle_Outcomes.draw] / summary['fights']
+    summary['mean_turns'] /= summary['fights']
+
+    return summary
+
+
+def merge_summaries(summaries):
+    # Combine summaries from summarize(), weighting each one by how many fights it covers
+    merged = summarize([])
+    for summary in summaries:
+        merged['fights'] += summary['fights']
+        for key in ('win_rate', 'lose_rate', 'draw_rate', 'mean_turns'):
+            merged[key] += summary[key] * summary['fights']
+
+        for side in ('player_items', 'enemy_items'):
+            for name, used in summary[side].items():
+                merged[side][name] = merged[side].get(name, 0) + used
+
+    if merged['fights'] > 0:
+        for key in ('win_rate', 'lose_rate', 'draw_rate', 'mean_turns'):
+            merged[key] /= merged['fights']
+
+    return merged
+
+
+#
+# Player Policies #
+#
+
+
+class battle_policy(ABC):
+    @abstractmethod
+    def choose(self, sim, plyr, enemy):
+        raise NotImplementedError('Please define this method.')
+        """
+        Return the attack or item that the player uses for this action, or None to pass. The simulator is passed in so that a policy can
+        use its random number generator (sim.randnum) and its helpers, like sim.percent_health() or sim.choose_attack().
+        """
+
+    def __call__(self, sim, plyr, enemy):
+        return self.choose(sim, plyr, enemy)
+
+
+class attack_policy(battle_policy):
+    # Always attacks, picking any attack that the player has enough ammo for, and passes when there is none
+    def choose(self, sim, plyr, enemy):
+        return sim.choose_attack(plyr)
+
+
+class heal_policy(battle_policy):
+    # Heals with the strongest healing item once health drops below a threshold, otherwise attacks
+    def __init__(self, threshold=40):
+        self.policy_dict = {'threshold': threshold}
+
+    @property
+    def threshold(self):
+        return self.policy_dict['threshold']
+
+    def choose(self, sim, plyr, enemy):
+        if sim.percent_health(plyr) <= self.threshold:
+            strongest = plyr.collection.items.best_heal()
+            if strongest is not None:
+                return strongest
+
+        return sim.choose_attack(plyr)
+
+
+#
+# Simulator #
+#
+
+
+class battle_simulator(battle_manager):
+    def __init__(self, seed=None, max_turns=200):
+        super().__init__()
+        self.sim_dict = {'rng': Random(seed), 'max_turns': max_turns, 'outcome': None, 'player': None}
+        self.sim_dict['player_items'] = {}
+        self.sim_dict['enemy_items'] = {}
+
+    @property
+    def max_turns(self):
+        return self.sim_dict['max_turns']
+
+    def seed(self, value):
+        self.sim_dict['rng'].seed(value)
+
+    def randnum(self, hi, lo=1):
+        # Same range as randint(lo, hi), without randint's argument checking overhead
+        if hi < lo:
+            raise ValueError(f'empty range for randnum ({lo}, {hi})')
+
+        return lo + int(self.sim_dict['rng'].random() * (hi - lo + 1))
+
+    # Silence everything that would be written to, or read from, the terminal
+    def narrate(self, phrase):
+        pass
+
+    def hit_animate(self):
+        pass
+
+    def draw_hp(self, plyr, enemy):
+        pass
+
+    def stat_change_writeout(self):
+        pass
+
+    def player_win(self, plyr, enemy):
+        self.sim_dict['outcome'] = Battle_Outcomes.player_win
+
+    def player_lose(self, plyr, enemy):
+        self.sim_dict['outcome'] = Battle_Outcomes.player_lose
+
+    def use_item(self, thing, itm):
+        if itm in thing.collection.items:
+            tally = self.sim_dict['player_items'] if thing is self.sim_dict['player'] else self.sim_dict['enemy_items']
+            tally[itm.name] = tally.get(itm.name, 0) + 1
+
+        return super().use_item(thing, itm)
+
+    def usable_attacks(self, thing):
+        # Attacks thing can pay for right now; none when it has no weapon equipped or has run out of ammo
+        return [attk for attk in (thing.attacks or []) if not isinstance(attk, ammo_attack) or thing.collection.items.count(attk.ammo_type) >= attk.ammo_cost]
+
+    def choose_attack(self, thing):
+        # A random usable attack, like enemy_determine_attack(), but None instead of looping forever when nothing can be used
+        usable = self.usable_attacks(thing)
+        if usable == []:
+            return None
+
+        return usable[self.randnum(len(usable)) - 1]
+
+    def snapshot(self, thing):
+        return (thing.stats.stat_array.copy(), thing.collection.items.copy())
+
+    def restore(self, thing, saved):
+        # A copy, since the saved stats are restored again after every fight
+        thing.stats.stat_array = saved[0].copy()
+        thing.collection.items.replace(saved[1])
+
+    def simulate(self, plyr, enemy, policy, spec_effect=None):
+        # Mirrors battle_manager.battle(), with the player's menus replaced by the policy
+        self.reset_battle()
+        self.sim_dict.update({'outcome': Battle_Outcomes.draw, 'player': plyr, 'player_items': {}, 'enemy_items': {}})
+        self.determine_first_turn(plyr, enemy)
+
+        def both_alive():
+            return (plyr.stats.health > 0) and (enemy.stats.health > 0)
+
+        while both_alive() and (self.battle_dict['turn_counter'] <= self.max_turns):
+            self.refresh_active_effect(plyr, enemy)
+
+            if spec_effect is not None:
+                spec_effect()
+
+            try:
+                if self.battle_dict['turn'] == Turn.Attack:
+                    while both_alive():
+                        choice = policy(self, plyr, enemy)
+
+                        if choice is None:
+                            # Nothing the player can do, so the action passes; max_turns ends a fight neither side can finish as a draw
+                            self.switch_turn(plyr.stats.power)
+                        elif isinstance(choice, attack):
+                            self.switch_turn(plyr.stats.power, self.use_attack(plyr, enemy, choice))
+                        else:
+                            self.switch_turn(plyr.stats.power, self.use_item(plyr, choice))
+
+                if self.battle_dict['turn'] == Turn.Defend:
+                    while both_alive():
+                        if self.randnum(100) <= self.chance_item(enemy):
+                            self.switch_turn(enemy.stats.power, self.enemy_use_item(enemy))
+                        else:
+                            choice = self.choose_attack(enemy)
+                            if choice is None:
+                                self.switch_turn(enemy.stats.power)
+                            else:
+                                self.switch_turn(enemy.stats.power, self.use_attack(enemy, plyr, choice))
+
+            except TurnComplete:
+                pass
+
+        if not both_alive():
+            if plyr.stats.health > 0:
+                self.player_win(plyr, enemy)
+            else:
+                self.player_lose(plyr, enemy)
+
+        return battle_result(self.sim_dict['outcome'], self.battle_dict['turn_counter'], plyr.stats.health, enemy.stats.health, self.sim_dict['player_items'], self.sim_dict['enemy_items'])
+
+    def run(self, plyr, enemy, policy, fights=1, spec_effect=None):
+        # Fight the same matchup repeatedly, putting both battlers back to how they started after every fight
+        saved_plyr = self.snapshot(plyr)
+        saved_enemy = self.snapshot(enemy)
+
+        results = []
+        for i in range(fights):
+            try:
+                results.append(self.simulate(plyr, enemy, policy, spec_effect))
+            finally:
+                self.restore(plyr, saved_plyr)
+                self.restore(enemy, saved_enemy)
+
+        return results
+
+
+#
+# Tournaments #
+#
+
+
+def run_matchup(job):
+    # Fights one player build against one enemy; this runs inside the tournament's worker processes
+    index, build_name, build, enemy_name, enemy, policy, fights, seed, max_turns = job
+
+    sim = battle_simulator(seed, max_turns)
+    summary = summarize(sim.run(build(), enemy(), policy, fights))
+    summary.update({'index': index, 'build': build_name, 'enemy': enemy_name, 'seed': seed})
+
+    return summary
+
+
+class tournament:
+    # builds and roster map names to functions that create a fresh player or enemy.
+    # Those functions are sent to other processes, so they must be defined at the top level of a module.
+    def __init__(self, builds, roster, policy=None, fights=100, seed=0, max_turns=200):
+        self.tourney_dict = {'builds': builds, 'roster': roster}
+        self.tourney_dict['policy'] = attack_policy() if policy is None else policy
+        self.tourney_dict['fights'] = fights
+        self.tourney_dict['seed'] = seed
+        self.tourney_dict['max_turns'] = max_turns
+        self.tourney_dict['results'] = []
+
+    @property
+    def results(self):
+        return self.tourney_dict['results']
+
+    def matchups(self):
+        # Each matchup gets its own seed from its position in the grid, so results never depend on how work is split between processes
+        seeds = np.random.SeedSequence(self.tourney_dict['seed']).spawn(len(self.tourney_dict['builds']) * len(self.tourney_dict['roster']))
+
+        jobs = []
+        for build_name, build in self.tourney_dict['builds'].items():
+            for enemy_name, enemy in self.tourney_dict['roster'].items():
+                index = len(jobs)
+                jobs.append((index, build_name, build, enemy_name, enemy, self.tourney_dict['policy'], self.tourney_dict['fights'], int(seeds[index].generate_state(1)[0]), self.tourney_dict['max_turns']))
+
+        return jobs
+
+    def run(self, workers=None, chunksize=None):
+        jobs = self.matchups()
+
+        if workers == 1:
+            results = [run_matchup(job) for job in jobs]
+        else:
+            from multiprocessing import Pool
+            with Pool(workers) as pool:
+                results = pool.map(run_matchup, jobs, chunksize)
+
+        self.tourney_dict['results'] = sorted(results, key=lambda result: result['index'])
+        return self.results
+
+    def standings(self, by='build'):
+        # Aggregate the results of every matchup for each build (or for each enemy, with by='enemy')
+        grouped = {}
+        for result in self.results:
+            grouped.setdefault(result[by], []).append(result)
+
+        return {name: merge_summaries(results) for name, results in grouped.items()}
+
+
+#
+# Damage Estimation #
+#
+
+
+class damage_estimator:
+    # Vectorized version of battle_manager.use_attack's dice rolls.
+    # Every stat argument may be a scalar or an array; they are broadcast together into one grid of matchups.
+    def __init__(self, seed=None, chunk_size=2 ** 22):
+        self.estimate_dict = {'rng': np.random.default_rng(seed), 'chunk_size': chunk_size}
+        # Same constant that battle_manager uses for its agility curve
+        self.estimate_dict['e'] = 2.7182
+
+    @property
+    def rng(self):
+        return self.estimate_dict['rng']
+
+    def calc_agility(self, agi):
+        return np.round(150 / (1 + (self.estimate_dict['e'] ** ((-1 / 30) * np.asarray(agi, dtype=float)))) - 75)
+
+    def roll(self, stren, agil, target_armor, target_agil, dmg, hit_rate, samples):
+        # Roll 'samples' attacks for every point in the grid; the first axis of each result is the sample
+        shape = (samples,) + np.shape(stren)
+
+        # Check if attack hits
+        hit_check = self.rng.integers(1, 101, size=shape)
+        hit_check = np.where(agil > target_agil, np.round(hit_check * 1.5), hit_check)
+        hit = (self.rng.integers(1, 101, size=shape) <= hit_rate) & (hit_check >= self.calc_agility(target_agil))
+
+        # Attack landed; calculate damage, with strength below 1 hitting like 1 as in battle_manager.use_attack()
+        stren = np.maximum(stren, 1)
+        bonus_cap = np.maximum(np.round((stren / 2) ** (1 / 2)), 1)
+        damage = np.round(((stren * dmg ** (stren ** .05)) ** .5) + self.rng.integers(1, bonus_cap + 1, size=shape))
+        damage = np.maximum(np.round(damage - target_armor ** (4 / 5)), 1)
+
+        # Check for crit
+        crit = self.rng.integers(1, 101, size=shape) <= self.calc_agility(agil)
+        damage = np.where(crit, np.round(damage * 3 / 2), damage)
+
+        return hit, crit, damage
+
+    def estimate(self, stren, agil, target_armor, target_agil, dmg, hit_rate=100, target_hp=None, power=1, samples=10000):
+        stren, agil, target_armor, target_agil, dmg, hit_rate = np.broadcast_arrays(*(np.asarray(i, dtype=float) for i in (stren, agil, target_armor, target_agil, dmg, hit_rate)))
+        grid = stren.shape
+
+        hits = np.zeros(grid)
+        crits = np.zeros(grid)
+        dmg_sum = np.zeros(grid)
+        dmg_sq_sum = np.zeros(grid)
+
+        # Roll in chunks so that large grids never hold every sample in memory at once
+        per_chunk = max(1, self.estimate_dict['chunk_size'] // max(stren.size, 1))
+        rolled = 0
+        while rolled < samples:
+            count = min(per_chunk, samples - rolled)
+            hit, crit, damage = self.roll(stren, agil, target_armor, target_agil, dmg, hit_rate, count)
+            damage = np.where(hit, damage, 0)
+
+            hits += hit.sum(axis=0)
+            crits += (hit & crit).sum(axis=0)
+            dmg_sum += damage.sum(axis=0)
+            dmg_sq_sum += (damage ** 2).sum(axis=0)
+            rolled += count
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            result = {'samples': samples, 'hit_rate': hits / samples}
+            result['crit_rate'] = np.where(hits > 0, crits / hits, 0)
+            result['mean_damage'] = np.where(hits > 0, dmg_sum / hits, 0)
+            result['std_damage'] = np.where(hits > 1, np.sqrt(np.maximum(dmg_sq_sum / hits - result['mean_damage'] ** 2, 0)), 0)
+            # Expected damage of one attempt, misses included
+            result['expected_damage'] = dmg_sum / samples
+
+            if target_hp is not None:
+                result['turns_to_kill'] = np.where(dmg_sum > 0, np.asarray(target_hp, dtype=float) / (result['expected_damage'] * np.asarray(power, dtype=float)), np.inf)
+
+        return result
+
+    def estimate_battlers(self, user, target, attk, samples=10000):
+        return self.estimate(user.stats.stren, user.stats.agility, target.stats.armor, target.stats.agility, attk.dmg, attk.hit_rate, target.stats.health, user.stats.power, samples)
+
+    def estimate_weapon(self, stren, agil, target_armor, target_agil, wpn, target_hp=None, power=1, samples=10000):
+        # Estimate every attack linked to a weapon across the same grid of stats
+        return {attk.name: self.estimate(stren, agil, target_armor, target_agil, attk.dmg, attk.hit_rate, target_hp, power, samples) for attk in wpn.linked_attacks}
+
+
+#
+# Economy #
+#
+
+
+def group_totals(keys, amounts):
+    # Running total of amounts within each run of equal keys, not counting the current entry; keys must already be sorted
+    totals = np.cumsum(amounts)
+    if len(keys) == 0:
+        return totals
+
+    first = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    runs = np.diff(np.r_[first, len(keys)])
+    return totals - amounts - np.repeat(totals[first] - amounts[first], runs)
+
+
+class economy_simulator:
+    # Many vendors and agents trading over many ticks, with everyone's stock, coin and prices kept in arrays.
+    # Trades follow vendor_collection.trade(): a purchase happens whole or not at all, and infinite-coin collections never gain or lose coin.
+    # vendors and agents may be entities or their collections; apply() writes the final state back to them.
+    # Number of price bins that demand is recorded in for elasticity()
+    demand_bin_count = 16
+
+    def __init__(self, vendors, agents, seed=None, income=0, demand=.5, elasticity=1.5, max_buy=3, sell_rate=.1, sell_ratio=.5, price_step=.02, price_bounds=(.5, 4), restock=0):
+        vendors = [getattr(thing, 'collection', thing) for thing in vendors]
+        agents = [getattr(thing, 'collection', thing) for thing in agents]
+
+        # Every kind of item held by anyone becomes a column
+        columns = {}
+        for collection in vendors + agents:
+            for itm in collection.items.kinds():
+                columns.setdefault(itm, len(columns))
+
+        self.econ_dict = {'rng': np.random.default_rng(seed), 'vendors': vendors, 'agents': agents, 'items': list(columns)}
+        self.econ_dict['base'] = np.array([itm.value for itm in columns], dtype=float)
+        self.econ_dict['stock'] = self.holdings(vendors, columns)
+        self.econ_dict['start_stock'] = self.econ_dict['stock'].copy()
+        self.econ_dict['held'] = self.holdings(agents, columns)
+        self.econ_dict['vendor_coin'], self.econ_dict['vendor_infinite'] = self.purses(vendors)
+        self.econ_dict['agent_coin'], self.econ_dict['agent_infinite'] = self.purses(agents)
+        self.econ_dict['prices'] = np.tile(self.econ_dict['base'], (len(vendors), 1))
+
+        # income: coin each agent earns per tick (e.g. from battles). demand and elasticity: the chance an agent buys what it looks at
+        # is demand * (price / value) ** -elasticity. Agents sell one unit back with chance sell_rate, for sell_ratio of the vendor's price.
+        # Prices rise by price_step when an item sells and fall by it while it sits unsold, within price_bounds times its value.
+        self.econ_dict['settings'] = {'income': income, 'demand': demand, 'elasticity': elasticity, 'max_buy': max_buy, 'sell_rate': sell_rate, 'sell_ratio': sell_ratio, 'price_step': price_step, 'price_bounds': price_bounds, 'restock': restock}
+        self.econ_dict['history'] = []
+
+        # Every look an agent takes at an item, binned by log(price / value): how many looks, how many wanted to buy, and the summed
+        # log ratio for the bin's centre. Which vendor (and so which price) an agent looks at is random, so this traces the demand curve
+        # itself, where sales per tick are tangled up with prices that move because of those same sales.
+        self.econ_dict['demand_bins'] = np.linspace(np.log(price_bounds[0]), np.log(price_bounds[1]), self.demand_bin_count + 1)
+        self.econ_dict['looks'] = np.zeros((len(columns), self.demand_bin_count))
+        self.econ_dict['wants'] = np.zeros((len(columns), self.demand_bin_count))
+        self.econ_dict['look_ratio'] = np.zeros((len(columns), self.demand_bin_count))
+
+    def holdings(self, collections, columns):
+        held = np.zeros((len(collections), len(columns)), dtype=np.int64)
+        for row, collection in enumerate(collections):
+            for itm, amnt in collection.items.stacks():
+                held[row, columns[itm]] = amnt
+
+        return held
+
+    def purses(self, collections):
+        # Coin for each collection, and which ones have infinite coin (their coin is kept at 0 and never changes)
+        coin = np.array([collection.coin for collection in collections], dtype=np.int64).reshape(len(collections))
+        infinite = coin == Enumerators.infinite_coin
+        coin[infinite] = 0
+
+        return coin, infinite
+
+    @property
+    def rng(self):
+        return self.econ_dict['rng']
+
+    @property
+    def items(self):
+        return self.econ_dict['items']
+
+    @property
+    def stock(self):
+        # Units of each item (columns) at each vendor (rows)
+        return self.econ_dict['stock']
+
+    @property
+    def prices(self):
+        return self.econ_dict['prices']
+
+    @property
+    def coin_supply(self):
+        # Coin held by everyone without infinite coin
+        return int(self.econ_dict['agent_coin'].sum() + self.econ_dict['vendor_coin'].sum())
+
+    def price_index(self):
+        # Mean price relative to value, over items that are worth something
+        base = self.econ_dict['base']
+        worth = base > 0
+        return float((self.prices[:, worth] / base[worth]).mean()) if worth.any() and len(self.prices) > 0 else 1.0
+
+    def buy(self):
+        # Each agent looks at one item at one vendor and may buy a few; on a crowded shelf, earlier agents are served first
+        d, settings, rng = self.econ_dict, self.econ_dict['settings'], self.rng
+        agents, (vendors, kinds) = len(d['agents']), d['stock'].shape
+        vendor = rng.integers(vendors, size=agents)
+        kind = rng.integers(kinds, size=agents)
+        amount = rng.integers(1, settings['max_buy'] + 1, size=agents)
+
+        with np.errstate(divide='ignore'):
+            ratio = np.where(d['base'][kind] > 0, d['prices'][vendor, kind] / d['base'][kind], 1)
+        wants = rng.random(agents) < np.clip(settings['demand'] * ratio ** -settings['elasticity'], 0, 1)
+        self.record_demand(kind, ratio, wants)
+
+        # Only the agents that want something go any further
+        buyers = np.flatnonzero(wants)
+        vendor, kind, amount = vendor[buyers], kind[buyers], amount[buyers]
+        price = np.rint(d['prices'][vendor, kind]).astype(np.int64)
+
+        # The whole purchase has to be affordable, like vendor_collection.trade()
+        amount *= d['agent_infinite'][buyers] | (d['agent_coin'][buyers] >= amount * price)
+
+        shelf = vendor * kinds + kind
+        order = np.argsort(shelf, kind='stable')
+        taken_before = group_totals(shelf[order], amount[order])
+        served = np.zeros(len(buyers), dtype=bool)
+        served[order] = taken_before + amount[order] <= d['stock'].ravel()[shelf[order]]
+        amount *= served
+
+        paid = amount * price
+        sold = np.bincount(shelf, weights=amount, minlength=vendors * kinds).astype(np.int64).reshape(vendors, kinds)
+        d['stock'] -= sold
+        d['held'][buyers, kind] += amount
+        d['agent_coin'][buyers] -= np.where(d['agent_infinite'][buyers], 0, paid)
+        d['vendor_coin'] += np.bincount(vendor, weights=np.where(d['vendor_infinite'][vendor], 0, paid), minlength=vendors).astype(np.int64)
+
+        return sold
+
+    def record_demand(self, kind, ratio, wants):
+        d = self.econ_dict
+        priced = d['base'][kind] > 0
+        kind, log_ratio, wants = kind[priced], np.log(ratio[priced]), wants[priced]
+        bins = d['demand_bins']
+        cell = kind * self.demand_bin_count + np.clip(np.searchsorted(bins, log_ratio, side='right') - 1, 0, self.demand_bin_count - 1)
+        size = d['looks'].size
+        d['looks'] += np.bincount(cell, minlength=size).reshape(d['looks'].shape)
+        d['wants'] += np.bincount(cell, weights=wants, minlength=size).reshape(d['wants'].shape)
+        d['look_ratio'] += np.bincount(cell, weights=log_ratio, minlength=size).reshape(d['look_ratio'].shape)
+
+    def sell_back(self):
+        # Some agents sell one unit of something they hold to a vendor, if the vendor can pay for it
+        d, settings, rng = self.econ_dict, self.econ_dict['settings'], self.rng
+        agents, (vendors, kinds) = len(d['agents']), d['stock'].shape
+        sellers = np.flatnonzero(rng.random(agents) < settings['sell_rate'])
+        held = d['held'][sellers]
+        held_total = held.sum(axis=1)
+        sellers, held, held_total = sellers[held_total > 0], held[held_total > 0], held_total[held_total > 0]
+
+        # Pick the unit at random, so items they hold more of are sold more often
+        pick = (rng.random(len(sellers)) * held_total).astype(np.int64)
+        kind = np.minimum((np.cumsum(held, axis=1) <= pick[:, None]).sum(axis=1), kinds - 1)
+        vendor = rng.integers(vendors, size=len(sellers))
+        offer = np.rint(d['prices'][vendor, kind] * settings['sell_ratio']).astype(np.int64)
+
+        order = np.argsort(vendor, kind='stable')
+        paid_before = group_totals(vendor[order], offer[order])
+        can_pay = np.zeros(len(sellers), dtype=bool)
+        can_pay[order] = d['vendor_infinite'][vendor[order]] | (paid_before + offer[order] <= d['vendor_coin'][vendor[order]])
+        sellers, kind, vendor, offer = sellers[can_pay], kind[can_pay], vendor[can_pay], offer[can_pay]
+
+        d['held'][sellers, kind] -= 1
+        d['stock'] += np.bincount(vendor * kinds + kind, minlength=vendors * kinds).reshape(vendors, kinds)
+        d['agent_coin'][sellers] += np.where(d['agent_infinite'][sellers], 0, offer)
+        d['vendor_coin'] -= np.bincount(vendor, weights=np.where(d['vendor_infinite'][vendor], 0, offer), minlength=vendors).astype(np.int64)
+
+        return len(sellers)
+
+    def tick(self):
+        d, settings = self.econ_dict, self.econ_dict['settings']
+        supply_before = self.coin_supply
+
+        earned = np.where(d['agent_infinite'], 0, settings['income'])
+        d['agent_coin'] += earned
+
+        if d['stock'].size > 0 and len(d['agents']) > 0:
+            sold = self.buy()
+            sold_back = self.sell_back()
+        else:
+            sold = np.zeros(d['stock'].shape, dtype=np.int64)
+            sold_back = 0
+
+        if settings['restock'] > 0:
+            d['stock'] = np.maximum(d['stock'], np.minimum(d['stock'] + settings['restock'], d['start_stock']))
+
+        # The price each unit was bought at, taken before the prices move in response to this tick's sales
+        units = sold.sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean_price = np.where(units > 0, (sold * np.rint(d['prices'])).sum(axis=0) / units, np.nan)
+
+        # Prices follow demand
+        step = settings['price_step']
+        low, high = settings['price_bounds']
+        d['prices'] *= np.where(sold > 0, 1 + step, np.where(d['stock'] > 0, 1 - step, 1))
+        np.clip(d['prices'], d['base'] * low, d['base'] * high, out=d['prices'])
+
+        record = {'coin_supply': self.coin_supply, 'minted': int(earned.sum()), 'units_bought': int(units.sum()), 'units_sold_back': sold_back}
+        # Coin that left the world (spent at infinite-coin vendors) or entered it from anywhere besides income
+        record['coin_change'] = record['coin_supply'] - supply_before
+        record['price_index'] = self.price_index()
+        record['stock'] = d['stock'].sum(axis=0)
+        record['out_of_stock'] = int(((d['stock'] == 0) & (d['start_stock'] > 0)).sum())
+        record['item_units'] = units
+        record['item_price'] = mean_price
+        d['history'].append(record)
+
+        return record
+
+    def run(self, ticks):
+        for i in range(ticks):
+            self.tick()
+
+        return self.metrics()
+
+    def metrics(self):
+        # Every recorded tick, as one array per measurement (per-item measurements have a column for each item)
+        history = self.econ_dict['history']
+        if history == []:
+            return {}
+
+        return {key: np.array([record[key] for record in history]) for key in history[0]}
+
+    def elasticity(self):
+        # Price elasticity of demand for each item: the slope of log(share of looks that wanted to buy) against log(price / value),
+        # so about -elasticity for the default demand model. Bins where everyone or no one wanted to buy say nothing about the slope and
+        # are left out; nan when fewer than three bins are left, or for items with no value.
+        d = self.econ_dict
+        slopes = np.full(len(self.items), np.nan)
+        for column in range(len(self.items)):
+            looks, wants = d['looks'][column], d['wants'][column]
+            used = (wants > 0) & (wants < looks)
+            if used.sum() > 2:
+                centre = d['look_ratio'][column, used] / looks[used]
+                # Bins with more buyers have less noise in their share
+                slopes[column] = np.polyfit(centre, np.log(wants[used] / looks[used]), 1, w=np.sqrt(wants[used]))[0]
+
+        return slopes
+
+    def apply(self):
+        # Write the simulated stock and coin back into the real collections
+        d = self.econ_dict
+        for collections, held, coin, infinite in ((d['vendors'], d['stock'], d['vendor_coin'], d['vendor_infinite']), (d['agents'], d['held'], d['agent_coin'], d['agent_infinite'])):
+            for row, collection in enumerate(collections):
+                stacks = item_stacks()
+                for column in np.flatnonzero(held[row]):
+                    stacks.add(self.items[column], int(held[row, column]))
+                collection.items.replace(stacks)
+
+                if not infinite[row]:
+                    # The coin setter adds to what is there
+                    collection.coin = int(coin[row]) - collection.coin